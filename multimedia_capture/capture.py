@@ -3,13 +3,12 @@ import time
 import config
 import datetime
 import subprocess
-import soundfile as sf
-import sounddevice as sd
 from os import path, mkdir
 from subprocess import call
 from datetime import datetime
-from picamera import PiCamera
-from PIL import Image
+
+# picamera, PIL, sounddevice and soundfile are imported inside the methods
+# that use them; most runs only need some of them.
 
 class Capture:
     def __init__(self):
@@ -55,6 +54,7 @@ class Capture:
 
     def init_camera(self):
         if self.camera is None:
+            from picamera import PiCamera
             self.camera = PiCamera()
             self.camera.resolution = (640, 480)
 
@@ -73,6 +73,7 @@ class Capture:
         return img_path
     
     def capture_rotated_photo(self, angle):
+        from PIL import Image
         img_path = self.capture_photo()
         img = Image.open(img_path)
         # Rotate the image by the specified angle
@@ -118,6 +119,8 @@ class Capture:
         if config.pi_version == 0:
             return self.pizero_capture_audio(capture_seconds)
         else:
+            import sounddevice as sd
+            import soundfile as sf
             sample_rate = 44100
             channels = 2
             duration = capture_seconds
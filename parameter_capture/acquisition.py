@@ -0,0 +1,62 @@
+import time
+import datetime
+import threading
+from collections import namedtuple
+
+# Concurrent sensor acquisition. The hive sensors sit on separate buses and
+# spend most of a reading waiting (the SCD41 conversion, the HX711 buffer,
+# the DHT22 single-wire exchange), so reading them one after the other makes
+# a cycle as long as all of them together. acquire() starts every reader in
+# a thread of its own and waits for each until its deadline, so a cycle
+# lasts about as long as the slowest sensor.
+#
+# Readers that miss their deadline are left running in a daemon thread (a
+# Python thread cannot be killed) and their default goes into the record; a
+# hung sensor neither blocks the cycle nor the interpreter's exit.
+
+# value is what the reader returned (the default if it failed or timed out),
+# seconds how long it took (None if it timed out) and error the exception or
+# "timeout"
+SensorResult = namedtuple("SensorResult", ["value", "seconds", "error"])
+
+
+# readers:          {name: callable}, each taking no arguments
+# deadlines:        {name: seconds from the start}, default_deadline for
+#                   readers without one
+# defaults:         {name: value recorded when the reader fails}, None if
+#                   missing
+# Returns the record, {"time": datetime of the start, name: value, ...}, and
+# {name: SensorResult}.
+def acquire(readers, deadlines=None, defaults=None, default_deadline=30.0):
+    deadlines = deadlines or {}
+    defaults = defaults or {}
+    lock = threading.Lock()
+    finished = {}
+
+    def run(name, reader):
+        start = time.monotonic()
+        try:
+            value, error = reader(), None
+        except Exception as e:
+            value, error = defaults.get(name), e
+        with lock:
+            finished[name] = SensorResult(value, time.monotonic() - start, error)
+
+    now = datetime.datetime.now()
+    start = time.monotonic()
+    threads = {}
+    for name, reader in readers.items():
+        threads[name] = threading.Thread(target=run, args=(name, reader), name="sensor-" + name, daemon=True)
+        threads[name].start()
+
+    for name, thread in threads.items():
+        thread.join(max(0.0, start + deadlines.get(name, default_deadline) - time.monotonic()))
+
+    with lock:
+        results = dict(finished)
+    record = {"time": now}
+    for name in readers:
+        if name not in results:
+            results[name] = SensorResult(defaults.get(name), None, "timeout")
+        record[name] = results[name].value
+    return record, results
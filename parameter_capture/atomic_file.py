@@ -0,0 +1,35 @@
+import os
+from contextlib import contextmanager
+
+# Replaces a file in one step, so a reader (or the next boot) sees either the
+# old contents or the new ones, never a truncated mix. The data goes to a
+# temporary file in the same directory, is flushed and fsync()ed, and is then
+# renamed over the target, and the directory is fsync()ed so the rename
+# itself survives a power cut. Without the fsync()s the rename can reach the
+# SD card before the data does and a power cut leaves an empty file.
+#
+#   with atomic_write(path) as f:
+#       json.dump(state, f)
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    tmp_path = path + ".%d.tmp" % os.getpid()
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
@@ -0,0 +1,156 @@
+import time
+import threading
+from collections import namedtuple
+
+# BME680 kept open across capture cycles, with the gas heater warmed up in
+# the background. The gas resistance of the first measurements after the
+# heater has been off climbs for a while before it settles, so the value a
+# freshly opened sensor returns first is not worth recording. start_warmup()
+# runs heater cycles (forced measurements) in a thread while the other
+# sensors are being read, and read() then only waits for whatever warm-up is
+# left, stops the cycling and takes its measurement.
+#
+# adafruit_bme680 keeps a measurement for 1/refresh_rate seconds (0.1s), so
+# the temperature, pressure, humidity and gas of a read(), taken one after
+# the other, all come from the forced measurement the first one triggers.
+
+BME680Reading = namedtuple("BME680Reading", ["temperature", "pressure", "humidity", "gas", "warm", "time"])
+
+
+class BME680:
+
+    # heater_temperature, heater_ms: heater profile of every measurement
+    # warmup_s:         longest read() waits for the gas reading to settle,
+    #                   counted from start_warmup()
+    # warmup_interval:  seconds between warm-up heater cycles
+    # stable_tolerance: the gas reading has settled once three consecutive
+    #                   readings differ by less than this fraction
+    # keep_warm_s:      seconds after its last cycle the heater still counts
+    #                   as warm, so readings that close together skip the
+    #                   warm-up
+    # max_heating_s:    the warm-up stops by itself after this long if no
+    #                   read() comes
+    def __init__(self, address=0x76, heater_temperature=320, heater_ms=150, warmup_s=15.0,
+                 warmup_interval=1.0, stable_tolerance=0.02, keep_warm_s=10.0, max_heating_s=300.0):
+        self.address = address
+        self.heater_temperature = heater_temperature
+        self.heater_ms = heater_ms
+        self.warmup_s = warmup_s
+        self.warmup_interval = warmup_interval
+        self.stable_tolerance = stable_tolerance
+        self.keep_warm_s = keep_warm_s
+        self.max_heating_s = max_heating_s
+        self.bme680 = None
+        self.warmup_error = None
+        self._last_heated = None
+        self._warmup_start = None
+        self._busLock = threading.Lock()
+        self._warmup = None
+        self._stopWarmup = threading.Event()
+        self._stable = threading.Event()
+
+    @property
+    def is_open(self):
+        return self.bme680 is not None
+
+    # the gas reading settled and the heater has run a cycle within
+    # keep_warm_s
+    @property
+    def warm(self):
+        return (self._stable.is_set() and self._last_heated is not None
+                and time.monotonic() - self._last_heated < self.keep_warm_s)
+
+    @property
+    def warming_up(self):
+        return self._warmup is not None and self._warmup.is_alive()
+
+    # a measurement, which is also a heater cycle
+    def _measure(self, gas_only=False):
+        with self._busLock:
+            if gas_only:
+                reading = self.bme680.gas
+            else:
+                temperature = self.bme680.temperature
+                reading = (temperature, self.bme680.pressure, self.bme680.humidity, self.bme680.gas)
+            self._last_heated = time.monotonic()
+        return reading
+
+    def open(self):
+        if self.is_open:
+            return
+        import board
+        import adafruit_bme680
+
+        # board.I2C() is shared by everything in the process, it is left
+        # open on close()
+        i2c = board.I2C()   # uses board.SCL and board.SDA
+        bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c, address=self.address)
+        if not bme680.set_gas_heater(self.heater_temperature, self.heater_ms):
+            raise RuntimeError("BME680 rejected the heater profile %dC %dms"
+                               % (self.heater_temperature, self.heater_ms))
+        self.bme680 = bme680
+        self._stable.clear()
+        self._last_heated = None
+
+    def close(self):
+        self.stop_warmup()
+        self.bme680 = None
+        self._stable.clear()
+
+    # Starts heating in the background, opening the sensor if needed. Call
+    # it early in the cycle; the heater then keeps cycling every
+    # warmup_interval until read() (or max_heating_s) stops it, however long
+    # the rest of the cycle takes. Does nothing while it is warm or warming.
+    def start_warmup(self):
+        if self.warm or self.warming_up:
+            return
+        self.open()
+        self.warmup_error = None
+        self._stable.clear()
+        self._stopWarmup.clear()
+        self._warmup_start = time.monotonic()
+        self._warmup = threading.Thread(target=self._warmup_loop, name="bme680-warmup", daemon=True)
+        self._warmup.start()
+
+    def stop_warmup(self):
+        warmup = self._warmup
+        if warmup is None:
+            return
+        self._stopWarmup.set()
+        warmup.join()
+        self._warmup = None
+
+    def _warmup_loop(self):
+        deadline = self._warmup_start + self.max_heating_s
+        gas = []
+        try:
+            while not self._stopWarmup.is_set() and time.monotonic() < deadline:
+                gas.append(self._measure(gas_only=True))
+                last = gas[-3:]
+                if len(last) == 3 and max(last) - min(last) < self.stable_tolerance * max(last):
+                    self._stable.set()
+                del gas[:-3]
+                self._stopWarmup.wait(self.warmup_interval)
+        except Exception as e:
+            # read() reports it, the sensor is opened again then
+            self.warmup_error = e
+            self._stable.set()
+
+    # One forced measurement once the gas reading has settled, waiting at
+    # most warmup_s from the start of the warm-up (started here if it was
+    # not running). `warm` in the reading tells whether it had settled and
+    # the heater had cycled within keep_warm_s.
+    def read(self):
+        self.start_warmup()
+        if self.warming_up:
+            self._stable.wait(max(0.0, self._warmup_start + self.warmup_s - time.monotonic()))
+        self.stop_warmup()
+        try:
+            if self.warmup_error is not None:
+                raise self.warmup_error
+            warm = self.warm
+            reading = BME680Reading(*self._measure(), warm=warm, time=time.time())
+        except Exception:
+            self.close()
+            raise
+        return reading
@@ -1,22 +1,13 @@
 import os
 import sys
 import csv
-import time
-import smbus
-import board
 import datetime
 import subprocess
-import numpy as np
-import adafruit_dht
-import adafruit_bme680
-import RPi.GPIO as GPIO
-from scipy import fftpack
-from sensirion_i2c_scd import Scd4xI2cDevice
-from sensirion_i2c_driver import LinuxI2cTransceiver, I2cConnection
-
-# select the correct i2c bus for this revision of Raspberry Pi
-revision = ([l[12:-1] for l in open('/proc/cpuinfo','r').readlines() if l[:8]=="Revision"]+['0000'])[0]
-bus = smbus.SMBus(1 if int(revision, 16) >= 4 else 0)
+
+# Sensor libraries (board, adafruit_dht, adafruit_bme680, RPi.GPIO, sensirion,
+# hx711) are imported where they are used and the sensors are opened on first
+# use, so importing this module costs next to nothing and a broken sensor
+# library only takes down its own reading.
 
 # ADXL345 constants
 EARTH_GRAVITY_MS2   = 9.80665
@@ -53,9 +44,12 @@ channel_3 = []
 
 sys.path.append('/home/pi/Desktop/HiveMonitor2/') #TODO: input to config 
 sys.path.append('/home/pi/Desktop/HiveMonitor2/parameter_capture/hx711py') #TODO: input to config 
+sys.path.append('/home/pi/Desktop/HiveMonitor2/parameter_capture/vibration_sensor') #TODO: input to config 
 
-from hx711py.hx711 import HX711
 from multimedia_capture.config import node_id
+from acquisition import acquire
+from scd41 import SCD41
+from bme680 import BME680
 
 
 class ParameterCapture:
@@ -72,41 +66,161 @@ class ParameterCapture:
         os.makedirs(self.sensor_data_dir, exist_ok=True)
         os.makedirs(self.logs_dir, exist_ok=True)
 
-        # Initialize DHT11 sensors
-        self.honey_dht22 = adafruit_dht.DHT22(board.D5)
-        self.brood_dht22 = adafruit_dht.DHT22(board.D21)
-        self.climate_dht22 = adafruit_dht.DHT22(board.D6)
+        # DHT22 sensors by board pin, opened on first use
+        self.DHT22_PINS = {"honey": "D5", "brood": "D21", "climate": "D6"}
+        self._dht22 = {}
 
-        # Initialize weight module
-        self.EMULATE_HX711 = False
+        # Weight module, initialised on first use. EMULATE_HX711 (environment
+        # variable of the same name) selects hx711py/emulated_hx711.py: "1"
+        # runs it unthrottled, "realtime" at the chip's 80SPS.
+        self.EMULATE_HX711 = os.environ.get("EMULATE_HX711", "")
         self.referenceUnit = 23.055
-        self.hx = HX711(0, 1)
-        self.hx.set_reading_format("MSB", "MSB")
-        self.hx.set_reference_unit(self.referenceUnit)
-        self.hx.reset()
-        self.hx.tare()
-       
+        self.weight_buffer_size = 64
+        self._hx = None
+        self._calibration = None
+        self.weight_calibration_file = f"{self.sensor_data_dir}/hx711_calibration.json"
+        self.last_weight = None
+
+        # CO2 sensor, kept open across cycles. "single_shot" measures on
+        # request, "low_power" leaves it measuring every 30s (see scd41.py).
+        # low_power only pays off in a process that runs many cycles: a new
+        # process (one per cron run) waits ~30s for its first reading, which
+        # acquire_sensors() then allows for.
+        self.co2_mode = "single_shot"
+        self._scd41 = None
+
+        # Gas sensor, kept open across cycles with its heater warmed up while
+        # the other sensors are read. last_bme680 holds the whole reading
+        # (temperature, pressure, humidity and gas).
+        self._bme680 = None
+        self.last_bme680 = None
+
+        # Seconds from the start of acquire_sensors() each sensor has to
+        # deliver, after which its failure value is recorded. The CO2 reading
+        # waits for a conversion (the deadline is raised to the SCD41's
+        # ready_timeout in low_power mode), the others are quick when the
+        # sensor works.
+        self.sensor_deadlines = {"co2": 20, "weight": 5, "honey": 5, "brood": 5, "climate": 5, "gas": 16}
+
+    def get_dht22(self, name):
+        if name not in self._dht22:
+            import board
+            import adafruit_dht
+            self._dht22[name] = adafruit_dht.DHT22(getattr(board, self.DHT22_PINS[name]))
+        return self._dht22[name]
+
+    @property
+    def honey_dht22(self):
+        return self.get_dht22("honey")
+
+    @property
+    def brood_dht22(self):
+        return self.get_dht22("brood")
+
+    @property
+    def climate_dht22(self):
+        return self.get_dht22("climate")
+
+    @property
+    def scd41(self):
+        if self._scd41 is None:
+            self._scd41 = SCD41(mode=self.co2_mode, asc=True)
+        return self._scd41
+
+    @property
+    def bme680(self):
+        if self._bme680 is None:
+            self._bme680 = BME680(address=0x76)
+        return self._bme680
+
+    @property
+    def hx(self):
+        if self._hx is None:
+            if self.EMULATE_HX711:
+                from hx711py.emulated_hx711 import HX711
+                hx = HX711(0, 1, scenario="steady", realtime=(self.EMULATE_HX711 == "realtime"),
+                           counts_per_gram=self.referenceUnit)
+            else:
+                from hx711py.hx711 import HX711
+                hx = HX711(0, 1)
+            hx.set_reading_format("MSB", "MSB")
+            hx.set_reference_unit(self.referenceUnit)
+            hx.reset()
+            # the offset and reference unit come from the stored calibration,
+            # taring here would zero whatever hive is on the scale
+            if not self.weight_calibration.apply(hx):
+                print("No stored weight calibration, run 'capture_parameters.py tare' with the scale empty")
+            self._hx = hx
+        return self._hx
+
 
     # Clean up and exit the program
     def clean_and_exit(self):
         print("Cleaning...")
+        if self._scd41 is not None:
+            self._scd41.close()
+        if self._bme680 is not None:
+            self._bme680.close()
+        import RPi.GPIO as GPIO
         GPIO.cleanup()
         print("Bye!")
         sys.exit()
 
-    # Measure hive weight using the weight module
+    @property
+    def weight_calibration(self):
+        if self._calibration is None:
+            from hx711py.calibration import CalibrationStore
+            self._calibration = CalibrationStore(self.weight_calibration_file)
+        return self._calibration
+
+    # Tares the weight module and stores the calibration, the scale must be
+    # empty. Only run by hand ('capture_parameters.py tare').
+    def tare_weight(self):
+        try:
+            temperature = self.climate_dht22.temperature
+        except Exception as e:
+            # stored without a temperature rather than with the failure value
+            print("Error with temperature and humidity sensor:", e)
+            temperature = None
+        offset = self.weight_calibration.calibrate(self.hx, temperature)
+        print("Weight sensor tared, offset %s at %s C" % (offset, temperature))
+
+    # Reports problems with the stored calibration for the weight just read
+    # (a negative weight means the offset was taken with a load on the
+    # scale). It never re-tares: there may be hives on the scale, re-taring
+    # is left to 'capture_parameters.py tare' with the scale empty.
+    # temperature is None when it could not be read.
+    def check_weight_calibration(self, temperature):
+        if self.last_weight is None:
+            return
+        try:
+            for kind, message in self.weight_calibration.diagnose(self.last_weight, temperature):
+                print("WEIGHT CALIBRATION:", message)
+                if kind == "negative":
+                    print("WEIGHT CALIBRATION: empty the scale and run 'capture_parameters.py tare'")
+        except Exception as e:
+            print("ERROR CHECKING WEIGHT CALIBRATION:", e)
+
+    # Starts the weight module sampling in the background, early in the cycle
+    # so its buffer has filled by the time measure_weight() runs and it does
+    # not have to wait for conversions
+    def start_weight_sampling(self):
+        try:
+            if not self.hx.sampling:
+                self.hx.start_sampling(self.weight_buffer_size)
+        except Exception as e:
+            print("ERROR WITH WEIGHT SENSOR:", e)
+
+    # Measure hive weight using the weight module, the median of the samples
+    # buffered in the background. The sampling stops once it is read, so the
+    # chip is left alone for the vibration capture that follows.
     def measure_weight(self):
         try:
-            average_times = 3
-            weight_list = []
-            for i in range(average_times):
-                val = max(0, int(self.hx.get_weight(5)))
-                weight = val / 1000
-                weight_list.append(weight)
-            averaged_weight = (sum(weight_list) / average_times)
-            weight = round(averaged_weight, 2) 
-            self.hx.power_down()
-            self.hx.power_up()
+            self.last_weight = self.hx.get_weight() / 1000
+            weight = round(max(0, int(self.last_weight * 1000)) / 1000, 2)
+            if self.hx.sampling:
+                print("Weight sample age: %.2f s, spread: %.0f counts"
+                      % (self.hx.sample_age(), self.hx.sample_variance() ** 0.5))
 
             if weight < self.EMPTY_HIVE_WEIGHT or weight > 250:
                 weight = 2
@@ -114,9 +228,15 @@ class ParameterCapture:
         except:
             weight = 2
             print("ERROR WITH WEIGHT SENSOR! .......weight = 2kg ")
+        finally:
+            self.stop_weight_sampling()
 
         return weight
 
+    def stop_weight_sampling(self):
+        if self._hx is not None:
+            self._hx.stop_sampling()
+
     # Measure temperature and humidity using DHT11 sensor
     def measure_temperature_humidity(self, sensor):
         try:
@@ -128,33 +248,15 @@ class ParameterCapture:
             humidity = 2
         return temperature, humidity
 
+    # Measure CO2 with the SCD41, waiting only for its conversion
     def capture_carbondioxide(self):
         try:
-            with LinuxI2cTransceiver('/dev/i2c-1') as i2c_transceiver:
-                i2c_connection = I2cConnection(i2c_transceiver)    
-                scd41 = Scd4xI2cDevice(i2c_connection)
-                scd41.set_automatic_self_calibration = True
-                scd41.get_automatic_self_calibration
-
-                # Start periodic measurement in high power mode
-                scd41.stop_periodic_measurement()
-                time.sleep(1)
-                scd41.reinit()
-                time.sleep(5)
-                scd41.start_periodic_measurement()
-
-                # Measure every 5 seconds
-                for i in range(0, 1):
-                    time.sleep(5)
-                    co2, temperature, humidity = scd41.read_measurement()
-                    print("Carbondioxide : " + "{:d} ppm CO2".format(co2.co2))
-
-                scd41.stop_periodic_measurement()
-
-            co2 = str(co2).split(" ")[0]
-        except:
+            co2, temperature, humidity = self.scd41.read()
+            print("Carbondioxide : " + "{:d} ppm CO2".format(co2))
+            co2 = str(co2)
+        except Exception as e:
             co2 = "2"
-            print("ERROR WITH CARBONDIOXIDE SENSOR....... Carbondioxide =  2")
+            print("ERROR WITH CARBONDIOXIDE SENSOR:", e, "....... Carbondioxide =  2")
             print()
 
         return co2
@@ -163,20 +265,14 @@ class ParameterCapture:
     @staticmethod
     def conv_str_tag(channel, tag):
         # Convert every channel from int to str, separated by a coma and adds tags at the beginning and end.
-        n = len(channel)
-        s_channel = '<' + tag + '>'
-        for i in range(n-1):
-            s_channel = s_channel + str(channel[i]) + ','
-        s_channel = s_channel + str(channel[n-1]) + '</'+ tag + '>'
-        return s_channel
+        return '<' + tag + '>' + ','.join(map(str, channel)) + '</'+ tag + '>'
 
     #####Add tags and save on file#####
     @staticmethod
     def record(channel_1, channel_2, channel_3, archive):
-        str_channel = ''
-        str_channel += ParameterCapture.conv_str_tag(channel_1, 'L1') + '\n'
-        str_channel += ParameterCapture.conv_str_tag(channel_2, 'L2') + '\n'
-        str_channel += ParameterCapture.conv_str_tag(channel_3, 'L3') + '\n'
+        str_channel = '\n'.join((ParameterCapture.conv_str_tag(channel_1, 'L1'),
+                                  ParameterCapture.conv_str_tag(channel_2, 'L2'),
+                                  ParameterCapture.conv_str_tag(channel_3, 'L3'))) + '\n'
 
         # Write to file
         arch = open("/home/pi/Desktop/HiveMonitor2/VIBRATIONSENSOR/textfile/"+archive, "w")
@@ -194,16 +290,23 @@ class ParameterCapture:
                 writer = csv.writer(f)
                 writer.writerow(data)
 
+    # Starts the BME680 heater warming up in the background, early in the
+    # cycle so it has settled by the time capture_gas() runs
+    def start_gas_warmup(self):
+        try:
+            self.bme680.start_warmup()
+        except Exception as e:
+            print("ERROR WITH GAS SENSOR:", e)
+
     # Capture gas readings from BME680 sensor
     def capture_gas(self):
         try:
-            # Create sensor object, communicating over the board's default I2C bus
-            i2c = board.I2C()   # uses board.SCL and board.SDA
-            bme680 = adafruit_bme680.Adafruit_BME680_I2C(i2c, address=0x76)
-            
-            # Get gas reading
-            gas = bme680.gas
-            print("Gas:", gas, "ohm")
+            # waits for what is left of the heater warm-up
+            self.last_bme680 = self.bme680.read()
+            gas = self.last_bme680.gas
+            print("Gas:", gas, "ohm" if self.last_bme680.warm else "ohm (heater not settled)")
+            print("BME680: %.1f C, %.1f hPa, %.1f %%" % (self.last_bme680.temperature,
+                                                         self.last_bme680.pressure, self.last_bme680.humidity))
         except Exception as e:
             gas = 2
             print("ERROR WITH GAS SENSOR:", e)
@@ -212,6 +315,44 @@ class ParameterCapture:
             
         return gas
 
+    # Capture vibration with the ADXL345 and save its spectrum to fft_log
+    def capture_vibration(self):
+        try:
+            import vibration
+            return vibration.mainprog()
+        except Exception as e:
+            print("ERROR WITH VIBRATION SENSOR:", e)
+            return None
+
+    # Reads every sensor concurrently (see acquisition.py) and returns one
+    # record, {"time": ..., "co2": ..., "weight": ..., "honey": (temperature,
+    # humidity), "brood": ..., "climate": ..., "gas": ...}. A sensor that
+    # fails or misses its deadline gets the usual 2.
+    def acquire_sensors(self):
+        readers = {
+            "co2": self.capture_carbondioxide,
+            "weight": self.measure_weight,
+            "gas": self.capture_gas,
+        }
+        for name in self.DHT22_PINS:
+            readers[name] = lambda name=name: self.measure_temperature_humidity(self.get_dht22(name))
+        defaults = {"co2": "2", "weight": 2, "gas": 2}
+        defaults.update((name, (2, 2)) for name in self.DHT22_PINS)
+
+        deadlines = dict(self.sensor_deadlines)
+        # a second for opening the session on top of the conversion wait
+        deadlines["co2"] = max(deadlines.get("co2", 0), self.scd41.ready_timeout + 1)
+
+        record, results = acquire(readers, deadlines, defaults)
+        for name, result in results.items():
+            if result.error == "timeout":
+                print("%s: no reading within %ss" % (name, deadlines.get(name)))
+            elif result.error is not None:
+                print("ERROR WITH %s SENSOR:" % name.upper(), result.error)
+            else:
+                print("%s: %.1f s" % (name, result.seconds))
+        return record
+
     # Run the data capture process
     def run_capture(self):
         current_time = datetime.datetime.now()
@@ -220,30 +361,27 @@ class ParameterCapture:
         print("------------------------------------- Date:", readable_time, "-----------------------------------")
         print()
 
+        self.start_weight_sampling()
+        self.start_gas_warmup()
+
         # Capture multimedia files
         subprocess.run(['/bin/python', '/home/pi/Desktop/HiveMonitor2/multimedia_capture/capture.py'])
 
-        # Capture carbon dioxide levels
-        co2 = self.capture_carbondioxide()
-        print("Carbondioxide:", co2, "ppm")
+        # CO2, weight, temperature/humidity and gas, all at once
+        record = self.acquire_sensors()
         print()
 
-        # Measure hive weight
-        weight = self.measure_weight()
+        co2 = record["co2"]
+        print("Carbondioxide:", co2, "ppm")
+        weight = record["weight"]
         print("Weight:", weight, "kg")
-        print()
-
-        # # Measure temperature and humidity for different sections
-        temperature_honey, humidity_honey = self.measure_temperature_humidity(self.honey_dht22)
-        temperature_brood, humidity_brood = self.measure_temperature_humidity(self.brood_dht22)
-        temperature_exterior, humidity_exterior = self.measure_temperature_humidity(self.climate_dht22)
+        temperature_honey, humidity_honey = record["honey"]
+        temperature_brood, humidity_brood = record["brood"]
+        temperature_exterior, humidity_exterior = record["climate"]
         print("Temperature Honey:", temperature_honey, "C Humidity Honey:", humidity_honey, "%")
         print("Temperature Brood:", temperature_brood, "C Humidity Brood:", humidity_brood, "%")
         print("Temperature Exterior:", temperature_exterior, "C Humidity Exterior:", humidity_exterior, "%")
-        print()
-
-        # Capture gas readings from BME680 sensor
-        gas = self.capture_gas()
+        gas = record["gas"]
         print()
 
         # # Write data to CSV
@@ -251,14 +389,18 @@ class ParameterCapture:
         temperature = "{}*{}*{}".format(temperature_honey, temperature_brood, temperature_exterior)
         humidity = "{}*{}*{}".format(humidity_honey, humidity_brood, humidity_exterior)
         carbondioxide = co2
-        date1 = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        date1 = record["time"].strftime("%Y-%m-%d %H:%M:%S")
         data = [date1, temperature, humidity, carbondioxide, weight, gas]
         self.write_data_to_csv(data)
         csv_filepath = os.path.realpath(self.filename)
         print("CSV File created at:", csv_filepath)
 
-        # Collecting vibration data
-        subprocess.run(['/bin/python', '/home/pi/Desktop/HiveMonitor2/parameter_capture/vibration_sensor/vibration.py'])
+        # (2, 2) is measure_temperature_humidity()'s failure value
+        self.check_weight_calibration(None if (temperature_exterior, humidity_exterior) == (2, 2)
+                                      else temperature_exterior)
+
+        # Collecting vibration data, in this interpreter rather than a new one
+        self.capture_vibration()
 
         # Send captured files to server
         subprocess.run(['/bin/python', '/home/pi/Desktop/HiveMonitor2/multimedia_capture/send_files_to_server.py'])
@@ -269,6 +411,11 @@ class ParameterCapture:
 if __name__ == "__main__":
     capture = ParameterCapture()
 
+    # capture_parameters.py tare: calibrate the empty scale and exit
+    if len(sys.argv) > 1 and sys.argv[1] == "tare":
+        capture.tare_weight()
+        sys.exit()
+
     # while(True):
     capture.run_capture()
         # time.sleep(1)
@@ -0,0 +1,77 @@
+# Times a sample read through each GPIO backend of hx711.py, to check the
+# per-bit overhead stays well inside the HX711's 60us PD_SCK high limit.
+# Backends whose library is not installed are skipped, the fake backend
+# always runs (it measures the Python side of a read on any machine). On the
+# hardware us/sample includes waiting for the conversion (12.5ms at 80SPS).
+#
+#   python3 benchmark.py                   # 1000 reads per backend
+#   python3 benchmark.py -n 5000 --dout 5 --pd-sck 6
+#   python3 benchmark.py --douts 5,13,19,26    # HX711Multi on 4 load cells
+
+import time
+import argparse
+
+import hx711
+
+
+def time_backend(backend, dout, pd_sck, reads):
+    hx = hx711.HX711(dout, pd_sck, backend=backend)
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        hx.read_long()
+    per_read = (time.perf_counter() - start) / reads
+
+    # the clocking alone, without waiting for a conversion
+    start = time.perf_counter()
+    for _ in range(reads):
+        hx.gpio.clock_bits(24)
+    per_clock = (time.perf_counter() - start) / reads / 24
+
+    backend.close()
+    return per_read * 1e6, per_clock * 1e6
+
+
+# us/sample reading every chip on douts with one HX711Multi pass
+def time_multi(backend, douts, pd_sck, reads):
+    hx = hx711.HX711Multi(douts, pd_sck, backend=backend)
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        hx.read_longs()
+    per_read = (time.perf_counter() - start) / reads
+
+    backend.close()
+    return per_read * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HX711 GPIO backends")
+    parser.add_argument("-n", "--reads", type=int, default=1000)
+    parser.add_argument("--dout", type=int, default=5)
+    parser.add_argument("--pd-sck", type=int, default=6)
+    parser.add_argument("--douts", help="comma separated DOUT pins sharing PD_SCK, times HX711Multi")
+    args = parser.parse_args()
+
+    print("%-8s %14s %14s" % ("backend", "us/sample", "us/clock"))
+    for name, backend_class in hx711.BACKENDS.items():
+        try:
+            backend = backend_class()
+            per_read, per_clock = time_backend(backend, args.dout, args.pd_sck, args.reads)
+        except (ImportError, RuntimeError, OSError) as e:
+            print("%-8s skipped: %s" % (name, e))
+            continue
+        print("%-8s %14.1f %14.2f" % (name, per_read, per_clock))
+
+    if args.douts:
+        douts = [int(pin) for pin in args.douts.split(",")]
+        print()
+        print("%-8s %14s %14s" % ("backend", "cells", "us/sample"))
+        for name, backend_class in hx711.BACKENDS.items():
+            for cells in range(1, len(douts) + 1):
+                try:
+                    per_read = time_multi(backend_class(), douts[:cells], args.pd_sck, args.reads)
+                except (ImportError, RuntimeError, OSError) as e:
+                    print("%-8s skipped: %s" % (name, e))
+                    break
+                print("%-8s %14d %14.1f" % (name, cells, per_read))
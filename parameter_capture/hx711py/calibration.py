@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+
+# atomic_file.py lives in parameter_capture/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from atomic_file import atomic_write
+
+
+# Persisted HX711 calibration: the channel A offset (raw reading of the empty
+# scale), the reference unit and the temperature it was taken at. Loading it
+# at startup replaces taring on every boot, which costs 15 reads and is wrong
+# whenever there is already a hive on the scale.
+class CalibrationStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+
+    # returns the stored calibration as a dict, None if there is none
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = None
+        return self.data
+
+    def save(self, offset, reference_unit, temperature=None):
+        self.data = {
+            "offset": offset,
+            "reference_unit": reference_unit,
+            "temperature": temperature,
+            "time": time.time(),
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(self.data, f, indent=1)
+
+    # sets the stored offset and reference unit on hx, False if there is
+    # nothing stored
+    def apply(self, hx):
+        if self.data is None and self.load() is None:
+            return False
+        hx.set_offset_A(self.data["offset"])
+        hx.set_reference_unit_A(self.data["reference_unit"])
+        return True
+
+    # tares hx (the scale must be empty) and stores the result
+    def calibrate(self, hx, temperature=None, times=15):
+        offset = hx.tare_A(times)
+        self.save(offset, hx.get_reference_unit_A(), temperature)
+        return offset
+
+    # Sanity checks of a weight read with the stored calibration. Returns a
+    # list of (kind, message) for every check that failed:
+    #   "missing"     nothing stored yet
+    #   "negative"    less than -negative_tolerance, the scale is lighter
+    #                 than when it was tared, so the offset was taken loaded
+    #   "temperature" more than max_temperature_delta away from the
+    #                 calibration temperature, the zero may have drifted
+    def diagnose(self, weight, temperature=None, negative_tolerance=0.5, max_temperature_delta=15.0):
+        if self.data is None and self.load() is None:
+            return [("missing", "no stored calibration")]
+        problems = []
+        if weight < -negative_tolerance:
+            problems.append(("negative", "weight %.2f is below zero" % weight))
+        calibrated_at = self.data.get("temperature")
+        if temperature is not None and calibrated_at is not None:
+            delta = abs(temperature - calibrated_at)
+            if delta > max_temperature_delta:
+                problems.append(("temperature", "%.1f C from the calibration temperature" % delta))
+        return problems
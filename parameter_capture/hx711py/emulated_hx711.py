@@ -1,330 +1,302 @@
+import sys
 import time
-import random
-import math
-import threading
+import argparse
+
+import numpy as np
+
+try:
+    from . import hx711
+    from . import filters
+except ImportError:
+    import hx711
+    import filters
+
+
+# Emulated HX711 with a load cell on it, for running and profiling the weight
+# code without a Pi. It is hx711.HX711 driving hx711.FakeBackend, so the whole
+# API (gain, channel B, tare, filters, background sampling) is the real code;
+# only the conversions come from a scenario.
+#
+# realtime=True  conversions arrive at sample_rate (80SPS) of the wall clock,
+#                as on the chip.
+# realtime=False (unthrottled) a conversion is always ready and the scenario
+#                time advances by 1/sample_rate per sample, so an hour of
+#                readings takes a fraction of a second.
+#
+#   python3 emulated_hx711.py              # benchmark every scenario and filter
+
+
+# Scenarios give the weight on the scale in kg at time t (seconds since the
+# first sample) and the noise on each reading. They draw from a seeded RNG,
+# so a given scenario and seed always produce the same samples.
+class Scenario:
+
+    # base_kg:    weight on the scale
+    # noise_kg:   standard deviation of the reading noise
+    # spike_rate: fraction of readings replaced by a wild value, like the
+    #             glitches seen on the real scale
+    def __init__(self, base_kg=40.0, noise_kg=0.005, spike_rate=0.0, seed=0):
+        self.base_kg = base_kg
+        self.noise_kg = noise_kg
+        self.spike_rate = spike_rate
+        self.seed = seed
+        self.reset()
+
+    # an instance whose event, if it has one, falls inside a run of run_s
+    # seconds
+    @classmethod
+    def for_run(cls, run_s, **kwargs):
+        return cls(**kwargs)
+
+    # time of a step in the weight, None if there is none
+    @property
+    def step_s(self):
+        return None
 
+    def reset(self):
+        self.rng = np.random.default_rng(self.seed)
 
-class HX711:
-    def __init__(self, dout, pd_sck, gain=128):
-        self.PD_SCK = pd_sck
-
-        self.DOUT = dout
+    def weight(self, t):
+        return self.base_kg
 
-        # Last time we've been read.
-        self.lastReadTime = time.time()
-        self.sampleRateHz = 80.0
-        self.resetTimeStamp = time.time()
-        self.sampleCount = 0
-        self.simulateTare = False
+    def noise(self, t):
+        return self.noise_kg
 
-        # Mutex for reading from the HX711, in case multiple threads in client
-        # software try to access get values from the class at the same time.
-        self.readLock = threading.Lock()
-        
-        self.GAIN = 0
-        self.REFERENCE_UNIT = 1  # The value returned by the hx711 that corresponds to your reference unit AFTER dividing by the SCALE.
-        
-        self.OFFSET = 1
-        self.lastVal = long(0)
+    # a reading in kg, noise and spikes included
+    def sample(self, t):
+        if self.spike_rate and self.rng.random() < self.spike_rate:
+            return self.rng.choice([0.0, 0.5, 2.0, 5.0]) * self.base_kg
+        return self.weight(t) + self.rng.normal(0.0, self.noise(t))
 
-        self.DEBUG_PRINTING = False
-        
-        self.byte_format = 'MSB'
-        self.bit_format = 'MSB'
+    # fault applied to the raw 24 bit word, none by default
+    def fault(self, word):
+        return word
 
-        self.set_gain(gain)
 
+class HoneyFlowRamp(Scenario):
 
+    # a nectar flow putting on kg_per_hour
+    def __init__(self, kg_per_hour=0.2, **kwargs):
+        self.kg_per_hour = kg_per_hour
+        Scenario.__init__(self, **kwargs)
 
+    # puts on 1kg over the run, far faster than a real flow but enough for a
+    # filter's lag to show in its error
+    @classmethod
+    def for_run(cls, run_s, **kwargs):
+        kwargs.setdefault("kg_per_hour", 3600.0 / run_s)
+        return cls(**kwargs)
 
-        # Think about whether this is necessary.
-        time.sleep(1)
-
-    def convertToTwosComplement24bit(self, inputValue):
-       # HX711 has saturating logic.
-       if inputValue >= 0x7fffff:
-          return 0x7fffff
-
-       # If it's a positive value, just return it, masked with our max value.
-       if inputValue >= 0:
-          return inputValue & 0x7fffff
-
-       if inputValue < 0:
-          # HX711 has saturating logic.
-          if inputValue < -0x800000:
-             inputValue = -0x800000
-
-          diff = inputValue + 0x800000
-
-          return 0x800000 + diff
-
-        
-    def convertFromTwosComplement24bit(self, inputValue):
-        return -(inputValue & 0x800000) + (inputValue & 0x7fffff)
-
-    
-    def is_ready(self):
-        # Calculate how long we should be waiting between samples, given the
-        # sample rate.
-        sampleDelaySeconds = 1.0 / self.sampleRateHz
-
-        return time.time() >= self.lastReadTime + sampleDelaySeconds
-
-    
-    def set_gain(self, gain):
-        if gain is 128:
-            self.GAIN = 1
-        elif gain is 64:
-            self.GAIN = 3
-        elif gain is 32:
-            self.GAIN = 2
-
-        # Read out a set of raw bytes and throw it away.
-        self.readRawBytes()
-
-        
-    def get_gain(self):
-        if self.GAIN == 1:
-            return 128
-        if self.GAIN == 3:
-            return 64
-        if self.GAIN == 2:
-            return 32
-
-        # Shouldn't get here.
-        return 0
-        
-
-    def readRawBytes(self):
-        # Wait for and get the Read Lock, incase another thread is already
-        # driving the virtual HX711 serial interface.
-        self.readLock.acquire()
-
-        # Wait until HX711 is ready for us to read a sample.
-        while not self.is_ready():
-           pass
-
-        self.lastReadTime = time.time()
-
-        # Generate a 24bit 2s complement sample for the virtual HX711.
-        rawSample = self.convertToTwosComplement24bit(self.generateFakeSample())
-        
-        # Read three bytes of data from the HX711.
-        firstByte  = (rawSample >> 16) & 0xFF
-        secondByte = (rawSample >> 8)  & 0xFF
-        thirdByte  = rawSample & 0xFF
-
-        # Release the Read Lock, now that we've finished driving the virtual HX711
-        # serial interface.
-        self.readLock.release()           
-
-        # Depending on how we're configured, return an orderd list of raw byte
-        # values.
-        if self.byte_format == 'LSB':
-           return [thirdByte, secondByte, firstByte]
-        else:
-           return [firstByte, secondByte, thirdByte]
+    def weight(self, t):
+        return self.base_kg + self.kg_per_hour * t / 3600.0
 
 
-    def read_long(self):
-        # Get a sample from the HX711 in the form of raw bytes.
-        dataBytes = self.readRawBytes()
+class SwarmDrop(Scenario):
 
+    # a swarm leaving with drop_kg of bees at at_s
+    def __init__(self, at_s=60.0, drop_kg=2.5, **kwargs):
+        self.at_s = at_s
+        self.drop_kg = drop_kg
+        Scenario.__init__(self, **kwargs)
 
-        if self.DEBUG_PRINTING:
-            print(dataBytes,)
-        
-        # Join the raw bytes into a single 24bit 2s complement value.
-        twosComplementValue = ((dataBytes[0] << 16) |
-                               (dataBytes[1] << 8)  |
-                               dataBytes[2])
+    # leaves half way through the run
+    @classmethod
+    def for_run(cls, run_s, **kwargs):
+        kwargs.setdefault("at_s", run_s / 2.0)
+        return cls(**kwargs)
 
-        if self.DEBUG_PRINTING:
-            print("Twos: 0x%06x" % twosComplementValue)
-        
-        # Convert from 24bit twos-complement to a signed value.
-        signedIntValue = self.convertFromTwosComplement24bit(twosComplementValue)
+    @property
+    def step_s(self):
+        return self.at_s
 
-        # Record the latest sample value we've read.
-        self.lastVal = signedIntValue
+    def weight(self, t):
+        return self.base_kg - (self.drop_kg if t >= self.at_s else 0.0)
 
-        # Return the sample value we've read from the HX711.
-        return int(signedIntValue)
 
-    
-    def read_average(self, times=3):
-        # Make sure we've been asked to take a rational amount of samples.
-        if times <= 0:
-            print("HX711().read_average(): times must >= 1!!  Assuming value of 1.")
-            times = 1
+class NoiseBursts(Scenario):
 
-        # If we're only average across one value, just read it and return it.
-        if times == 1:
-            return self.read_long()
+    # wind or handling: burst_noise_kg of noise for burst_s every every_s
+    def __init__(self, every_s=30.0, burst_s=5.0, burst_noise_kg=0.5, **kwargs):
+        self.every_s = every_s
+        self.burst_s = burst_s
+        self.burst_noise_kg = burst_noise_kg
+        Scenario.__init__(self, **kwargs)
 
-        # If we're averaging across a low amount of values, just take an
-        # arithmetic mean.
-        if times < 5:
-            values = int(0)
-            for i in range(times):
-                values += self.read_long()
+    def noise(self, t):
+        return self.burst_noise_kg if t % self.every_s < self.burst_s else self.noise_kg
 
-            return values / times
 
-        # If we're taking a lot of samples, we'll collect them in a list, remove
-        # the outliers, then take the mean of the remaining set.
-        valueList = []
+class StuckBit(Scenario):
 
-        for x in range(times):
-            valueList += [self.read_long()]
+    # a data bit of the conversion stuck at level, e.g. a bad solder joint
+    def __init__(self, bit=16, level=1, **kwargs):
+        self.bit = bit
+        self.level = level
+        Scenario.__init__(self, **kwargs)
 
-        valueList.sort()
+    def fault(self, word):
+        if self.level:
+            return word | (1 << self.bit)
+        return word & ~(1 << self.bit)
 
-        # We'll be trimming 20% of outlier samples from top and bottom of collected set.
-        trimAmount = int(len(valueList) * 0.2)
 
-        # Trim the edge case values.
-        valueList = valueList[trimAmount:-trimAmount]
+class LegacySine(Scenario):
 
-        # Return the mean of remaining samples.
-        return sum(valueList) / len(valueList)
+    # what this emulator produced before: |sin| swinging up to 72kg, 1kg of
+    # noise and an occasional wild reading
+    def __init__(self, **kwargs):
+        kwargs.setdefault("noise_kg", 0.577)
+        kwargs.setdefault("spike_rate", 1.0 / 142)
+        Scenario.__init__(self, **kwargs)
 
-    
-    def get_value(self, times=3):
-        return self.read_average(times) - self.OFFSET
+    def weight(self, t):
+        return abs(np.sin(np.radians(t * 20))) * 72.0
 
-    
-    def get_weight(self, times=3):
-        value = self.get_value(times)
-        value = value / self.REFERENCE_UNIT
-        return value
 
-    
-    def tare(self, times=15):
-        # If we aren't simulating Taring because it takes too long, just skip it.
-        if not self.simulateTare:
-            return 0
+SCENARIOS = {
+    "steady": Scenario,
+    "honey_flow": HoneyFlowRamp,
+    "swarm": SwarmDrop,
+    "noise_bursts": NoiseBursts,
+    "stuck_bit": StuckBit,
+    "sine": LegacySine,
+}
 
-        # Backup REFERENCE_UNIT value
-        reference_unit = self.REFERENCE_UNIT
-        self.set_reference_unit(1)
 
-        value = self.read_average(times)
+class HX711(hx711.HX711):
+
+    # scenario:        a Scenario or a SCENARIOS name
+    # counts_per_gram: raw counts per gram of the emulated load cell at gain
+    #                  128, None follows the reference unit set on the
+    #                  instance so weights come out in grams (the old
+    #                  behaviour)
+    # zero_counts:     raw reading of the empty scale
+    def __init__(self, dout=5, pd_sck=6, gain=128, scenario="sine", realtime=True, sample_rate=80.0,
+                 seed=0, counts_per_gram=None, zero_counts=0, ready_timeout=1.0):
+        if isinstance(scenario, str):
+            if scenario not in SCENARIOS:
+                raise ValueError("Unrecognised scenario: \"%s\"" % scenario)
+            scenario = SCENARIOS[scenario](seed=seed)
+        self.scenario = scenario
+        self.realtime = realtime
+        self.sampleRateHz = sample_rate
+        self.counts_per_gram = counts_per_gram
+        self.zero_counts = zero_counts
+        self.sampleCount = 0
+        self.resetTimeStamp = time.monotonic()
 
-        if self.DEBUG_PRINTING:
-            print("Tare value:", value)
-        
-        self.set_offset(value)
+        # Taring reads 15 samples, skip it in realtime mode unless asked to
+        self.simulateTare = not realtime
+        if not realtime:
+            self.settle_time = 0.0
 
-        # Restore the reference unit, now that we've got our offset.
-        self.set_reference_unit(reference_unit)
+        self.fake = hx711.FakeBackend(self.generateFakeSample, power_down_s=60e-6 if realtime else None)
+        hx711.HX711.__init__(self, dout, pd_sck, gain, backend=self.fake, ready_timeout=ready_timeout)
 
-        return value;
 
-    
-    def set_reading_format(self, byte_format="LSB", bit_format="MSB"):
+    # seconds of scenario time the next sample is taken at
+    def sample_time(self):
+        return self.sampleCount / self.sampleRateHz
 
-        if byte_format == "LSB":
-            self.byte_format = byte_format
-        elif byte_format == "MSB":
-            self.byte_format = byte_format
-        else:
-            print("Unrecognised byte_format: \"%s\"" % byte_format)
 
-        if bit_format == "LSB":
-            self.bit_format = bit_format
-        elif bit_format == "MSB":
-            self.bit_format = bit_format
+    def generateFakeSample(self):
+        if self.realtime:
+            due = int((time.monotonic() - self.resetTimeStamp) * self.sampleRateHz)
+            if self.sampleCount >= due:
+                # next conversion not finished yet, DOUT stays high
+                return None
+
+        kg = self.scenario.sample(self.sample_time())
+        self.sampleCount += 1
+
+        counts_per_gram = self.REFERENCE_UNIT if self.counts_per_gram is None else self.counts_per_gram
+        gain_pulses = self.fake.next_pulses
+        if gain_pulses == 2:
+            # channel B is not wired to anything
+            counts = self.scenario.rng.normal(0.0, 20.0)
         else:
-            print("Unrecognised bit_format: \"%s\"" % bit_format)
-
-            
-
-    def set_offset(self, offset):
-        self.OFFSET = offset
-
-        
-    def get_offset(self):
-        return self.OFFSET
-
-    
-    def set_reference_unit(self, reference_unit):
-        # Make sure we aren't asked to use an invalid reference unit.
-        if reference_unit == 0:
-            print("HX711().set_reference_unit(): Can't use 0 as a reference unit!!")
-            return
-
-        self.REFERENCE_UNIT = reference_unit
-
-
-    def power_down(self):
-        # Wait for and get the Read Lock, incase another thread is already
-        # driving the HX711 serial interface.
-        self.readLock.acquire()
+            counts = kg * 1000.0 * counts_per_gram + self.zero_counts
+            if gain_pulses == 3:
+                counts /= 2.0    # gain 64
 
-        # Wait 100us for the virtual HX711 to power down.
-        time.sleep(0.0001)
+        word = self.convertToTwosComplement24bit(int(counts))
+        return self.convertFromTwosComplement24bit(self.scenario.fault(word))
 
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()           
 
+    def convertToTwosComplement24bit(self, inputValue):
+        # HX711 has saturating logic.
+        inputValue = max(-0x800000, min(0x7fffff, inputValue))
+        return inputValue & 0xffffff
 
-    def power_up(self):
-        # Wait for and get the Read Lock, incase another thread is already
-        # driving the HX711 serial interface.
-        self.readLock.acquire()
-
-        # Wait 100 us for the virtual HX711 to power back up.
-        time.sleep(0.0001)
-
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()
 
-        # HX711 will now be defaulted to Channel A with gain of 128.  If this
-        # isn't what client software has requested from us, take a sample and
-        # throw it away, so that next sample from the HX711 will be from the
-        # correct channel/gain.
-        if self.get_gain() != 128:
-            self.readRawBytes()
+    def tare(self, times=15):
+        # If we aren't simulating Taring because it takes too long, just skip it.
+        if not self.simulateTare:
+            return 0
+        return hx711.HX711.tare(self, times)
 
 
     def reset(self):
-        # self.power_down()
-        # self.power_up()
-
-        # Mark time when we were reset.  We'll use this for sample generation.
-        self.resetTimeStamp = time.time()
-
-
-    def generateFakeSample(self):
-       sampleTimeStamp = time.time() - self.resetTimeStamp
-
-       noiseScale = 1.0
-       noiseValue = random.randrange(-(noiseScale * 1000),(noiseScale * 1000)) / 1000.0
-       sample     = math.sin(math.radians(sampleTimeStamp * 20)) * 72.0
-
-       self.sampleCount += 1
-
-       if sample < 0.0:
-          sample = -sample
-
-       sample += noiseValue
+        hx711.HX711.reset(self)
 
-       BIG_ERROR_SAMPLE_FREQUENCY = 142
-       ###BIG_ERROR_SAMPLE_FREQUENCY = 15
-       BIG_ERROR_SAMPLES = [0.0, 40.0, 70.0, 150.0, 280.0, 580.0]
-
-       if random.randrange(0, BIG_ERROR_SAMPLE_FREQUENCY) == 0:
-          sample = random.sample(BIG_ERROR_SAMPLES, 1)[0]
-          print("Sample %d: Injecting %f as a random bad sample." % (self.sampleCount, sample))
-
-       sample *= 1000
-
-       sample *= self.REFERENCE_UNIT
-
-       return int(sample)
+        # Mark time when we were reset, realtime conversions are paced from it.
+        self.resetTimeStamp = time.monotonic()
+        self.sampleCount = 0
+        self.scenario.reset()
+
+
+# Reads `samples` conversions of every scenario unthrottled and reports the
+# cost per read and the mean absolute error of each filter against the true
+# weight, to compare filters on a laptop. Scenario events are placed inside
+# the run. For a scenario with a step the error before and after it and the
+# time a filter takes to come within settle_fraction of the step of the new
+# weight are reported as well.
+def benchmark(samples=4000, seed=0, sample_rate=80.0, settle_fraction=0.01):
+    filter_names = ["none"] + list(filters.FILTERS)
+    run_s = samples / sample_rate
+    print("%-16s %9s  %s" % ("scenario", "us/read", "  ".join("%9s" % name for name in filter_names)))
+    for name, scenario_class in SCENARIOS.items():
+        scenario = scenario_class.for_run(run_s, seed=seed)
+        hx = HX711(scenario=scenario, realtime=False, sample_rate=sample_rate, counts_per_gram=1.0)
+        # opening the chip already took a conversion
+        times = (hx.sampleCount + np.arange(samples)) / sample_rate
+        truth = np.array([scenario.weight(t) for t in times]) * 1000.0
+
+        start = time.perf_counter()
+        raw = np.array([hx.read_long() for _ in range(samples)], dtype=np.float64)
+        per_read = (time.perf_counter() - start) / samples * 1e6
+
+        errors = []
+        for filter_name in filter_names:
+            if filter_name == "none":
+                output = raw
+            else:
+                f = filters.FILTERS[filter_name]()
+                output = np.array([f.update(value) for value in raw])
+            errors.append(np.abs(output - truth))
+
+        print("%-16s %9.1f  %s" % (name, per_read, "  ".join("%9.1f" % np.mean(e) for e in errors)))
+        if scenario.step_s is None:
+            continue
+        step = np.searchsorted(times, scenario.step_s)
+        tolerance = settle_fraction * abs(truth[step] - truth[step - 1])
+        settle = []
+        for e in errors:
+            within = np.nonzero(e[step:] <= tolerance)[0]
+            settle.append(within[0] / sample_rate if len(within) else np.inf)
+        print("%-16s %9s  %s" % ("  before step", "", "  ".join("%9.1f" % np.mean(e[:step]) for e in errors)))
+        print("%-16s %9s  %s" % ("  after step", "", "  ".join("%9.1f" % np.mean(e[step:]) for e in errors)))
+        print("%-16s %9s  %s" % ("  settle (s)", "", "  ".join("%9.2f" % s for s in settle)))
+    print("(errors in grams, settle: to within %g%% of the step)" % (settle_fraction * 100))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the weight filters against emulated scenarios")
+    parser.add_argument("-n", "--samples", type=int, default=4000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark(args.samples, args.seed)
+    sys.exit(0)
 
 
 # EOF - emulated_hx711.py
@@ -0,0 +1,283 @@
+#
+# Streaming filters for load cell samples. Every filter takes one sample at a
+# time through update(), which returns the filtered value, keeps its current
+# output in `value` (None until the first sample) and can be cleared with
+# reset(). HX711.set_filter() selects one per instance.
+#
+#   StreamingMedian  median of a sliding window, two heaps, O(log n)
+#   HampelFilter     replaces samples far from the window median, O(log n)
+#   TrimmedMean      mean of a sliding window without its extremes
+#   Kalman1D         scalar Kalman filter for a slowly drifting weight, O(1)
+#   FilterChain      several of the above one after the other
+
+import heapq
+from bisect import bisect_left
+from collections import deque
+
+
+class Filter:
+
+    value = None
+
+    def update(self, sample):
+        raise NotImplementedError
+
+    def reset(self):
+        self.value = None
+
+
+class StreamingMedian(Filter):
+
+    # Median of the last `window` samples. The lower half lives in a max heap
+    # and the upper half in a min heap; samples leaving the window are only
+    # marked and dropped once they reach the top of their heap. Marked
+    # samples buried in a heap are cleared by rebuilding both heaps from the
+    # window once there are more than 2 * window of them, so memory stays
+    # bounded however long the filter runs.
+    def __init__(self, window=15):
+        if window < 1:
+            raise ValueError("StreamingMedian(): window must be >= 1")
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self._low = []          # max heap, values negated
+        self._high = []         # min heap
+        self._low_size = 0      # live entries, excluding marked ones
+        self._high_size = 0
+        self._delayed = {}
+        self._stale = 0         # marked entries still in the heaps
+        self._samples = deque()
+
+    def _prune(self, heap, sign):
+        while heap:
+            top = sign * heap[0]
+            if self._delayed.get(top):
+                self._delayed[top] -= 1
+                if not self._delayed[top]:
+                    del self._delayed[top]
+                self._stale -= 1
+                heapq.heappop(heap)
+            else:
+                break
+
+    def _balance(self):
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._high_size -= 1
+            self._low_size += 1
+            self._prune(self._high, 1)
+
+    def _rebuild(self):
+        ordered = sorted(self._samples)
+        middle = (len(ordered) + 1) // 2
+        self._low = [-sample for sample in ordered[:middle]]
+        heapq.heapify(self._low)
+        self._high = ordered[middle:]
+        self._low_size = len(self._low)
+        self._high_size = len(self._high)
+        self._delayed = {}
+        self._stale = 0
+
+    def _remove(self, sample):
+        self._delayed[sample] = self._delayed.get(sample, 0) + 1
+        self._stale += 1
+        if sample <= -self._low[0]:
+            self._low_size -= 1
+            if sample == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if self._high and sample == self._high[0]:
+                self._prune(self._high, 1)
+        self._balance()
+
+    def update(self, sample):
+        if not self._low or sample <= -self._low[0]:
+            heapq.heappush(self._low, -sample)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, sample)
+            self._high_size += 1
+        self._balance()
+
+        self._samples.append(sample)
+        if len(self._samples) > self.window:
+            self._remove(self._samples.popleft())
+            if self._stale > 2 * self.window:
+                self._rebuild()
+
+        if self._low_size > self._high_size:
+            self.value = -self._low[0]
+        else:
+            self.value = (-self._low[0] + self._high[0]) / 2.0
+        return self.value
+
+
+class HampelFilter(Filter):
+
+    # A sample further than `threshold` scale estimates from the median of
+    # the last `window` samples is an outlier and replaced by that median.
+    # The scale is a running mean of the absolute deviation from the median
+    # (an O(1) stand-in for the window's MAD), scaled to a standard deviation.
+    def __init__(self, window=7, threshold=3.0, alpha=0.1):
+        self.window = window
+        self.threshold = threshold
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.outliers = 0
+        self._median = StreamingMedian(self.window)
+        self._scale = None
+        self._count = 0
+
+    def update(self, sample):
+        median = self._median.update(sample)
+        self._count += 1
+        deviation = abs(sample - median)
+        if self._scale is None:
+            self._scale = 1.4826 * deviation
+            self.value = sample
+            return self.value
+
+        limit = self.threshold * self._scale
+        # let the scale settle over the first window before rejecting
+        if self._count > self.window and deviation > limit:
+            self.outliers += 1
+            self.value = median
+            deviation = limit
+        else:
+            self.value = sample
+        self._scale += self.alpha * (1.4826 * deviation - self._scale)
+        return self.value
+
+
+class TrimmedMean(Filter):
+
+    # Mean of the last `window` samples after dropping the `trim` fraction
+    # at either end, like read_average(). The window is kept sorted with
+    # bisect, so finding a sample is O(log n), and the sum of the kept band
+    # [_low, _high) of it is updated at its edges rather than summed again,
+    # a few additions per sample. (Inserting into the sorted list is still a
+    # memmove of up to `window` entries, done in C.)
+    def __init__(self, window=15, trim=0.2):
+        if not 0 <= trim < 0.5:
+            raise ValueError("TrimmedMean(): trim must be in [0, 0.5)")
+        self.window = window
+        self.trim = trim
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self._samples = deque()
+        self._sorted = []
+        self._low = 0
+        self._high = 0
+        self._kept_sum = 0
+
+    # moves the kept band to [low, high) of the sorted window
+    def _move_band(self, low, high):
+        s = self._sorted
+        while self._high < high:
+            self._kept_sum += s[self._high]
+            self._high += 1
+        while self._low > low:
+            self._low -= 1
+            self._kept_sum += s[self._low]
+        while self._low < low:
+            self._kept_sum -= s[self._low]
+            self._low += 1
+        while self._high > high:
+            self._high -= 1
+            self._kept_sum -= s[self._high]
+
+    def update(self, sample):
+        self._samples.append(sample)
+        index = bisect_left(self._sorted, sample)
+        self._sorted.insert(index, sample)
+        # the band in the new positions: the sample lands inside it or
+        # shifts it up by one
+        if index < self._low:
+            self._low += 1
+            self._high += 1
+        elif index <= self._high:
+            self._high += 1
+            self._kept_sum += sample
+
+        if len(self._samples) > self.window:
+            old = self._samples.popleft()
+            index = bisect_left(self._sorted, old)
+            del self._sorted[index]
+            if index < self._low:
+                self._low -= 1
+                self._high -= 1
+            elif index < self._high:
+                self._high -= 1
+                self._kept_sum -= old
+
+        count = len(self._sorted)
+        trim = int(count * self.trim)
+        self._move_band(trim, count - trim)
+        self.value = self._kept_sum / (count - 2 * trim)
+        return self.value
+
+
+class Kalman1D(Filter):
+
+    # Random walk model: the weight drifts by process_variance per sample and
+    # every reading carries measurement_variance of noise (both in raw
+    # counts squared). A larger process_variance follows changes faster.
+    def __init__(self, process_variance=1.0, measurement_variance=100.0):
+        self.process_variance = process_variance
+        self.measurement_variance = measurement_variance
+        self.reset()
+
+    def reset(self):
+        self.value = None
+        self.variance = None
+
+    def update(self, sample):
+        if self.value is None:
+            self.value = float(sample)
+            self.variance = self.measurement_variance
+            return self.value
+        variance = self.variance + self.process_variance
+        gain = variance / (variance + self.measurement_variance)
+        self.value += gain * (sample - self.value)
+        self.variance = (1.0 - gain) * variance
+        return self.value
+
+
+class FilterChain(Filter):
+
+    # e.g. FilterChain(HampelFilter(), Kalman1D()) rejects spikes before
+    # smoothing
+    def __init__(self, *filters):
+        self.filters = filters
+
+    def reset(self):
+        self.value = None
+        for f in self.filters:
+            f.reset()
+
+    def update(self, sample):
+        for f in self.filters:
+            sample = f.update(sample)
+        self.value = sample
+        return self.value
+
+
+FILTERS = {
+    "median": StreamingMedian,
+    "hampel": HampelFilter,
+    "trimmed": TrimmedMean,
+    "kalman": Kalman1D,
+}
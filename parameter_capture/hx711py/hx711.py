@@ -1,25 +1,416 @@
 #
 
-import RPi.GPIO as GPIO
 import time
 import threading
+from functools import partial
+from contextlib import contextmanager
 
+import numpy as np
+
+
+# GPIO backends drive the PD_SCK and DOUT lines for HX711. The HX711 powers
+# down if PD_SCK stays high for more than 60us, so the per-bit work in
+# clock_bits() is kept to the bare pin calls, looked up once in setup().
+#
+#   RPiGPIOBackend  RPi.GPIO (the default)
+#   LgpioBackend    lgpio, which also works on the Pi 5 where RPi.GPIO does not
+#   FakeBackend     a pin level model of an HX711, for running without hardware
+class GPIOBackend:
+
+    name = None
+
+    def setup(self, dout, pd_sck):
+        raise NotImplementedError
+
+    def set_clock(self, level):
+        raise NotImplementedError
+
+    def read_dout(self):
+        raise NotImplementedError
+
+    # Clocks `count` bits out of the HX711 and returns them MSB first. DOUT
+    # is ready 0.1us after the rising edge of PD_SCK, so it is sampled after
+    # lowering PD_SCK, when we know it is stable.
+    def clock_bits(self, count):
+        set_clock = self.set_clock
+        read_dout = self.read_dout
+        value = 0
+        for _ in range(count):
+            set_clock(1)
+            set_clock(0)
+            value = (value << 1) | read_dout()
+        return value
+
+    # Waits up to `timeout` seconds for DOUT to go low (a conversion is
+    # ready) and returns whether it did. This version polls, sleeping 100us
+    # at first and backing off to 5ms, which is short next to the 12.5ms
+    # (80SPS) or 100ms (10SPS) conversion period.
+    def wait_for_ready(self, timeout):
+        read_dout = self.read_dout
+        deadline = time.monotonic() + timeout
+        delay = 0.0001
+        while read_dout():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.005)
+        return True
+
+    # Several HX711s sharing one PD_SCK: setup_multi() claims every DOUT pin,
+    # read_douts() returns their levels as a mask (bit i is douts[i]) and
+    # clock_bits_multi() returns one mask per clock, so the words of all the
+    # chips come out of a single pass of `count` clocks.
+    def setup_multi(self, douts, pd_sck):
+        raise NotImplementedError
+
+    def read_douts(self):
+        raise NotImplementedError
+
+    def clock_bits_multi(self, count):
+        set_clock = self.set_clock
+        read_douts = self.read_douts
+        masks = []
+        for _ in range(count):
+            set_clock(1)
+            set_clock(0)
+            masks.append(read_douts())
+        return masks
+
+    # wait_for_ready() for every DOUT set up by setup_multi()
+    def wait_for_all_ready(self, timeout):
+        read_douts = self.read_douts
+        deadline = time.monotonic() + timeout
+        delay = 0.0001
+        while read_douts():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.005)
+        return True
+
+    def close(self):
+        pass
+
+
+class RPiGPIOBackend(GPIOBackend):
+
+    name = "rpi"
+
+    def setup(self, dout, pd_sck):
+        import RPi.GPIO as GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pd_sck, GPIO.OUT)
+        GPIO.setup(dout, GPIO.IN)
+        self.dout = dout
+        self.pd_sck = pd_sck
+        self._output = GPIO.output
+        self._input = GPIO.input
+        self._wait_for_edge = GPIO.wait_for_edge
+        self._falling = GPIO.FALLING
+
+    def set_clock(self, level):
+        self._output(self.pd_sck, level)
+
+    # Sleeps in the kernel until DOUT falls. The wait is done in slices,
+    # checking the level in between, so an edge that comes just before the
+    # wait starts costs at most one slice.
+    def wait_for_ready(self, timeout, slice_s=0.05):
+        if self._wait_for_edge is None:
+            return GPIOBackend.wait_for_ready(self, timeout)
+        deadline = time.monotonic() + timeout
+        while self._input(self.dout):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                self._wait_for_edge(self.dout, self._falling, timeout=max(1, int(min(remaining, slice_s) * 1000)))
+            except RuntimeError:
+                # edge detection already in use on the pin (or unavailable),
+                # poll from now on
+                self._wait_for_edge = None
+                return GPIOBackend.wait_for_ready(self, max(0.0, deadline - time.monotonic()))
+        return True
+
+    def read_dout(self):
+        return self._input(self.dout)
+
+    def clock_bits(self, count):
+        output = self._output
+        input_ = self._input
+        pd_sck = self.pd_sck
+        dout = self.dout
+        value = 0
+        for _ in range(count):
+            output(pd_sck, 1)
+            output(pd_sck, 0)
+            value = (value << 1) | input_(dout)
+        return value
+
+    # RPi.GPIO has no call reading several pins at once, each DOUT is one
+    # input() after the falling edge. PD_SCK is only high for the two
+    # output() calls whatever the number of chips.
+    def setup_multi(self, douts, pd_sck):
+        import RPi.GPIO as GPIO
+        self.setup(douts[0], pd_sck)
+        for dout in douts[1:]:
+            GPIO.setup(dout, GPIO.IN)
+        self.douts = list(douts)
+
+    def read_douts(self):
+        input_ = self._input
+        mask = 0
+        for bit, dout in enumerate(self.douts):
+            mask |= input_(dout) << bit
+        return mask
+
+    def clock_bits_multi(self, count):
+        output = self._output
+        read_douts = self.read_douts
+        pd_sck = self.pd_sck
+        masks = []
+        for _ in range(count):
+            output(pd_sck, 1)
+            output(pd_sck, 0)
+            masks.append(read_douts())
+        return masks
+
+
+class LgpioBackend(GPIOBackend):
+
+    name = "lgpio"
+
+    def __init__(self, chip=0):
+        self.chip = chip
+        self._handle = None
+
+    def setup(self, dout, pd_sck):
+        import lgpio
+        self._lgpio = lgpio
+        self._handle = lgpio.gpiochip_open(self.chip)
+        lgpio.gpio_claim_output(self._handle, pd_sck, 0)
+        lgpio.gpio_claim_input(self._handle, dout)
+        # bind the chip handle and pin once, so every pin access is a
+        # single C call
+        self._write = partial(lgpio.gpio_write, self._handle, pd_sck)
+        self._read = partial(lgpio.gpio_read, self._handle, dout)
+
+    def set_clock(self, level):
+        self._write(level)
+
+    def read_dout(self):
+        return self._read()
+
+    def clock_bits(self, count):
+        write = self._write
+        read = self._read
+        value = 0
+        for _ in range(count):
+            write(1)
+            write(0)
+            value = (value << 1) | read()
+        return value
+
+    # The DOUT pins are claimed as a group, so group_read() samples all of
+    # them in the one C call and a clock costs the same for any number of
+    # chips.
+    def setup_multi(self, douts, pd_sck):
+        import lgpio
+        self._lgpio = lgpio
+        self._handle = lgpio.gpiochip_open(self.chip)
+        lgpio.gpio_claim_output(self._handle, pd_sck, 0)
+        lgpio.group_claim_input(self._handle, list(douts))
+        self._write = partial(lgpio.gpio_write, self._handle, pd_sck)
+        self._read_group = partial(lgpio.group_read, self._handle, douts[0])
+
+    def read_douts(self):
+        return self._read_group()[1]
+
+    def clock_bits_multi(self, count):
+        write = self._write
+        read_group = self._read_group
+        masks = []
+        for _ in range(count):
+            write(1)
+            write(0)
+            masks.append(read_group()[1])
+        return masks
+
+    def close(self):
+        if self._handle is not None:
+            self._lgpio.gpiochip_close(self._handle)
+            self._handle = None
+
+
+class FakeBackend(GPIOBackend):
+
+    name = "fake"
+
+    # source: callable returning the next signed 24 bit conversion, a constant
+    # 0 if None. If it returns None there is no conversion (DOUT stays high,
+    # as with a disconnected chip). A conversion is ready as soon as DOUT is
+    # read without clocking, the pulses after the 24 data bits select the
+    # channel and gain of the next one and holding PD_SCK high for over
+    # power_down_s (60us) powers it down, as on the chip. With power_down_s
+    # None it never powers down, which keeps a run deterministic however the
+    # host schedules us.
+    #
+    # After setup_multi() every DOUT gets a chip model of its own, all
+    # clocked together. `source` is then a list with a source per DOUT, or a
+    # single source shared by all of them.
+    def __init__(self, source=None, power_down_s=60e-6):
+        self.source = source
+        self.power_down_s = power_down_s
+        self.dout = None
+        self.pd_sck = None
+        self.clock = 0
+        self.pulses = 0
+        self.next_pulses = 1    # channel A, gain 128 after power up
+        self.power_downs = 0
+        self._word = None
+        self._edge = False
+        self._rise_time = 0.0
+        self.chips = []
+
+    def setup(self, dout, pd_sck):
+        self.dout = dout
+        self.pd_sck = pd_sck
+
+    def setup_multi(self, douts, pd_sck):
+        sources = self.source if isinstance(self.source, (list, tuple)) else [self.source] * len(douts)
+        if len(sources) != len(douts):
+            raise ValueError("FakeBackend(): %d sources for %d DOUT pins" % (len(sources), len(douts)))
+        self.chips = [FakeBackend(source, self.power_down_s) for source in sources]
+        for chip, dout in zip(self.chips, douts):
+            chip.setup(dout, pd_sck)
+        self.pd_sck = pd_sck
+
+    def read_douts(self):
+        mask = 0
+        for bit, chip in enumerate(self.chips):
+            mask |= chip.read_dout() << bit
+        return mask
+
+    def set_clock(self, level):
+        for chip in self.chips:
+            chip.set_clock(level)
+        if level and not self.clock:
+            self.pulses += 1
+            self._edge = True
+            self._rise_time = time.perf_counter()
+        elif (not level and self.clock and self.power_down_s is not None
+              and time.perf_counter() - self._rise_time > self.power_down_s):
+            # powered down, it comes back up on channel A gain 128
+            self.power_downs += 1
+            self.pulses = 0
+            self.next_pulses = 1
+            self._word = None
+        self.clock = level
+
+    def read_dout(self):
+        edge = self._edge
+        self._edge = False
+        if self.pulses > 24:
+            if edge:
+                # DOUT stays high until the next conversion
+                return 1
+            self.next_pulses = self.pulses - 24
+            self.pulses = 0
+            self._word = None
+        elif self.pulses and not edge:
+            # waiting for data in the middle of a word (a read cut short by
+            # a power down), the next conversion replaces it
+            self.pulses = 0
+            self._word = None
+        if self._word is None:
+            value = self.source() if self.source is not None else 0
+            if value is None:
+                return 1
+            self._word = max(-0x800000, min(0x7fffff, int(value))) & 0xffffff
+        if 0 < self.pulses <= 24:
+            return (self._word >> (24 - self.pulses)) & 1
+        return 0
+
+
+BACKENDS = {
+    "rpi": RPiGPIOBackend,
+    "lgpio": LgpioBackend,
+    "fake": FakeBackend,
+}
+
+
+class HX711TimeoutError(TimeoutError):
+    pass
+
+
+# reverses the bit order of a byte, for bit_format 'LSB'
+REVERSED_BITS = [int("{:08b}".format(i)[::-1], 2) for i in range(256)]
+
+# trailing pulses that select channel B (gain 32) for the next conversion
+CHANNEL_B_PULSES = 2
+
+
+# The last `size` samples of one channel read by the background sampler,
+# with the time each was read and their exponential moving average. The
+# sampler holds HX711._ringLock around every access.
+class SampleRing:
+
+    def __init__(self, size, ema_alpha=0.2):
+        self.values = np.zeros(size, dtype=np.float64)
+        self.times = np.zeros(size, dtype=np.float64)
+        self.index = 0
+        self.count = 0
+        self.ema = None
+        self.ema_alpha = ema_alpha
+        self.filled = threading.Event()
+
+    def append(self, value, now):
+        self.values[self.index] = value
+        self.times[self.index] = now
+        self.index = (self.index + 1) % len(self.values)
+        self.count = min(self.count + 1, len(self.values))
+        if self.ema is None:
+            self.ema = float(value)
+        else:
+            self.ema += self.ema_alpha * (value - self.ema)
+        self.filled.set()
+
+    # the last `window` samples (all of them if None), oldest order not kept
+    def last(self, window=None):
+        count = self.count if window is None else min(window, self.count)
+        return self.values[(self.index - count + np.arange(count)) % len(self.values)]
+
+    def newest_time(self):
+        return self.times[(self.index - 1) % len(self.values)]
 
 
 class HX711:
 
-    def __init__(self, dout, pd_sck, gain=128):
+    # seconds to wait after setting the gain in __init__
+    settle_time = 1.0
+
+    # backend:       a GPIOBackend instance or a BACKENDS name, RPi.GPIO by default
+    # ready_timeout: seconds a read waits for a conversion before raising
+    #                HX711TimeoutError
+    def __init__(self, dout, pd_sck, gain=128, backend=None, ready_timeout=1.0):
         self.PD_SCK = pd_sck
 
         self.DOUT = dout
+        self.ready_timeout = ready_timeout
 
         # Mutex for reading from the HX711, in case multiple threads in client
         # software try to access get values from the class at the same time.
         self.readLock = threading.Lock()
-        
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.PD_SCK, GPIO.OUT)
-        GPIO.setup(self.DOUT, GPIO.IN)
+
+        if backend is None:
+            backend = RPiGPIOBackend()
+        elif isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise ValueError("Unrecognised backend: \"%s\"" % backend)
+            backend = BACKENDS[backend]()
+        self.gpio = backend
+        self.gpio.setup(self.DOUT, self.PD_SCK)
 
         self.GAIN = 0
 
@@ -28,8 +419,8 @@ class HX711:
         self.REFERENCE_UNIT = 1
         self.REFERENCE_UNIT_B = 1
 
-        self.OFFSET = 1
-        self.OFFSET_B = 1
+        self.OFFSET = 0
+        self.OFFSET_B = 0
         self.lastVal = int(0)
 
         self.DEBUG_PRINTING = False
@@ -37,10 +428,17 @@ class HX711:
         self.byte_format = 'MSB'
         self.bit_format = 'MSB'
 
+        # Streaming filter for channel A, see set_filter().
+        self.filter = None
+
+        # Pulses clocked after the last read, which select the channel and
+        # gain of the conversion the chip is making now (A 128 at power up).
+        self.pending_pulses = 1
+
         self.set_gain(gain)
 
         # Think about whether this is necessary.
-        time.sleep(1)
+        time.sleep(self.settle_time)
 
         
     def convertFromTwosComplement24bit(self, inputValue):
@@ -48,7 +446,7 @@ class HX711:
 
     
     def is_ready(self):
-        return GPIO.input(self.DOUT) == 0
+        return self.gpio.read_dout() == 0
 
     
     def set_gain(self, gain):
@@ -59,7 +457,7 @@ class HX711:
         elif gain ==32:
             self.GAIN = 2
 
-        GPIO.output(self.PD_SCK, False)
+        self.gpio.set_clock(False)
 
         # Read out a set of raw bytes and throw it away.
         self.readRawBytes()
@@ -81,54 +479,54 @@ class HX711:
        # Clock HX711 Digital Serial Clock (PD_SCK).  DOUT will be
        # ready 1us after PD_SCK rising edge, so we sample after
        # lowering PD_SCL, when we know DOUT will be stable.
-       GPIO.output(self.PD_SCK, True)
-       GPIO.output(self.PD_SCK, False)
-       value = GPIO.input(self.DOUT)
-
-       # Convert Boolean to int and return it.
-       return int(value)
+       return self.gpio.clock_bits(1)
 
 
     def readNextByte(self):
-       byteValue = 0
-
-       # Read bits and build the byte from top, or bottom, depending
-       # on whether we are in MSB or LSB bit mode.
-       for x in range(8):
-          if self.bit_format == 'MSB':
-             byteValue <<= 1
-             byteValue |= self.readNextBit()
-          else:
-             byteValue >>= 1              
-             byteValue |= self.readNextBit() * 0x80
+       byteValue = self.gpio.clock_bits(8)
+
+       # Bits arrive MSB first, flip them in LSB bit mode.
+       if self.bit_format == 'LSB':
+          byteValue = REVERSED_BITS[byteValue]
 
        # Return the packed byte.
        return byteValue 
         
 
-    def readRawBytes(self):
+    # next_pulses: the pulses clocked after the data, which select the
+    # channel and gain of the next conversion, self.GAIN if None
+    def readRawBytes(self, next_pulses=None):
+        if next_pulses is None:
+            next_pulses = self.GAIN
+
         # Wait for and get the Read Lock, incase another thread is already
         # driving the HX711 serial interface.
         self.readLock.acquire()
-
-        # Wait until HX711 is ready for us to read a sample.
-        while not self.is_ready():
-           pass
-
-        # Read three bytes of data from the HX711.
-        firstByte  = self.readNextByte()
-        secondByte = self.readNextByte()
-        thirdByte  = self.readNextByte()
-
-        # HX711 Channel and gain factor are set by number of bits read
-        # after 24 data bits.
-        for i in range(self.GAIN):
-           # Clock a bit out of the HX711 and throw it away.
-           self.readNextBit()
-
-        # Release the Read Lock, now that we've finished driving the HX711
-        # serial interface.
-        self.readLock.release()           
+        try:
+            # Wait until HX711 is ready for us to read a sample, without
+            # holding a core while we do.
+            if not self.gpio.wait_for_ready(self.ready_timeout):
+                raise HX711TimeoutError("HX711 on DOUT %s not ready after %ss, is it connected?"
+                                        % (self.DOUT, self.ready_timeout))
+
+            # Read the 24 data bits in one go, then the pulses that select the
+            # channel and gain of the next conversion, to keep PD_SCK pulses
+            # short.
+            value = self.gpio.clock_bits(24)
+            self.gpio.clock_bits(next_pulses)
+            self.pending_pulses = next_pulses
+        finally:
+            # Release the Read Lock, now that we've finished driving the HX711
+            # serial interface.
+            self.readLock.release()
+
+        firstByte  = (value >> 16) & 0xFF
+        secondByte = (value >> 8) & 0xFF
+        thirdByte  = value & 0xFF
+        if self.bit_format == 'LSB':
+           firstByte  = REVERSED_BITS[firstByte]
+           secondByte = REVERSED_BITS[secondByte]
+           thirdByte  = REVERSED_BITS[thirdByte]
 
         # Depending on how we're configured, return an orderd list of raw byte
         # values.
@@ -138,9 +536,9 @@ class HX711:
            return [firstByte, secondByte, thirdByte]
 
 
-    def read_long(self):
+    def read_long(self, next_pulses=None):
         # Get a sample from the HX711 in the form of raw bytes.
-        dataBytes = self.readRawBytes()
+        dataBytes = self.readRawBytes(next_pulses)
 
 
         if self.DEBUG_PRINTING:
@@ -220,8 +618,218 @@ class HX711:
        else:
           # If times is even we have to take the arithmetic mean of
           # the two middle values.
-          midpoint = len(valueList) / 2
-          return sum(valueList[midpoint:midpoint+2]) / 2.0
+          midpoint = len(valueList) // 2
+          return sum(valueList[midpoint-1:midpoint+1]) / 2.0
+
+
+    # Selects the streaming filter get_value_A() passes samples through: a
+    # filters.Filter instance, one of the filters.FILTERS names (created with
+    # its default settings) or None for the plain read_median(). The filter
+    # keeps its state between calls, so a few samples per call are enough.
+    def set_filter(self, filter):
+        if isinstance(filter, str):
+            try:
+                from . import filters
+            except ImportError:
+                import filters
+            if filter not in filters.FILTERS:
+                raise ValueError("Unrecognised filter: \"%s\"" % filter)
+            filter = filters.FILTERS[filter]()
+        self.filter = filter
+
+
+    # Reads `times` samples through the filter and returns its output.
+    def read_filtered(self, times=3):
+        if times <= 0:
+            raise ValueError("HX711::read_filtered(): times must be greater than zero!")
+        for x in range(times):
+            value = self.filter.update(self.read_long())
+        return value
+
+
+    # trailing pulses that select `channel` ("A" at the set gain, or "B")
+    def _channel_pulses(self, channel):
+        return CHANNEL_B_PULSES if channel == "B" else self.GAIN
+
+
+    # Reads `times` channel A samples with a channel B sample after every
+    # b_every of them, and returns the two lists. The pulses after each read
+    # select the channel of the next conversion, so unlike get_value_B() no
+    # conversion is read and thrown away to switch channel. The last read
+    # selects channel A again.
+    def read_interleaved(self, times=3, b_every=1):
+        if times <= 0 or b_every <= 0:
+            raise ValueError("HX711::read_interleaved(): times and b_every must be greater than zero!")
+        if self.GAIN == CHANNEL_B_PULSES:
+            raise ValueError("HX711::read_interleaved(): channel A needs gain 128 or 64")
+        schedule = []
+        for x in range(times):
+            schedule.append("A")
+            if (x + 1) % b_every == 0:
+                schedule.append("B")
+        values = {"A": [], "B": []}
+        with self._sampling_suspended():
+            # the conversion in progress was selected by the last read: keep
+            # it if it is on channel B, it is only of no use on channel A at
+            # another gain (e.g. after a power up)
+            if self.pending_pulses == CHANNEL_B_PULSES:
+                values["B"].append(self.read_long(self._channel_pulses(schedule[0])))
+            elif self.pending_pulses != self.GAIN:
+                self.read_long(self._channel_pulses(schedule[0]))
+            for i, channel in enumerate(schedule):
+                next_channel = schedule[i + 1] if i + 1 < len(schedule) else "A"
+                values[channel].append(self.read_long(self._channel_pulses(next_channel)))
+        return values["A"], values["B"]
+
+
+    # Starts a background thread that reads channel A continuously at the
+    # chip's own rate into a ring buffer of the last buffer_size samples.
+    # While it runs get_value_A()/get_weight_A() return at once with the
+    # `method` statistic of the buffer ("median", "trimmed" mean, "ema" or
+    # the output of the set_filter() "filter") instead of reading the chip.
+    #
+    # With b_every set channel B is sampled too, one conversion after every
+    # b_every channel A ones, into a buffer of its own that get_value_B()
+    # then uses; the channels are switched as in read_interleaved(). Each
+    # switch still costs the chip's settling time before the conversion.
+    def start_sampling(self, buffer_size=64, method="median", ema_alpha=0.2, b_every=None):
+        if method not in ("median", "trimmed", "ema", "filter"):
+            raise ValueError("Unrecognised method: \"%s\"" % method)
+        if method == "filter" and self.filter is None:
+            raise ValueError("HX711::start_sampling(): no filter set")
+        if b_every is not None and (b_every <= 0 or self.GAIN == CHANNEL_B_PULSES):
+            raise ValueError("HX711::start_sampling(): b_every needs b_every >= 1 and channel A at gain 128 or 64")
+        self.stop_sampling()
+
+        self.sample_method = method
+        self.ema_alpha = ema_alpha
+        self.sample_b_every = b_every
+        self.sampling_error = None
+        self._rings = {"A": SampleRing(buffer_size, ema_alpha)}
+        if b_every is not None:
+            self._rings["B"] = SampleRing(buffer_size, ema_alpha)
+        self._ringLock = threading.Lock()
+        self._stopSampling = threading.Event()
+        self._sampler = threading.Thread(target=self._sampling_loop, name="hx711-sampler", daemon=True)
+        self._sampler.start()
+
+
+    def stop_sampling(self):
+        sampler = getattr(self, "_sampler", None)
+        if sampler is None:
+            return
+        self._stopSampling.set()
+        # a read in progress ends within ready_timeout
+        sampler.join(self.ready_timeout + 1.0)
+        self._sampler = None
+
+
+    @property
+    def sampling(self):
+        return getattr(self, "_sampler", None) is not None
+
+
+    def _store_sample(self, channel, value):
+        with self._ringLock:
+            self._rings[channel].append(value, time.monotonic())
+            if channel == "A" and self.filter is not None:
+                self.filter.update(value)
+
+
+    def _sampling_loop(self):
+        b_every = self.sample_b_every
+        sinceB = 0
+        while not self._stopSampling.is_set():
+            # the conversion being read is on the channel the last read chose
+            channel = "B" if b_every is not None and self.pending_pulses == CHANNEL_B_PULSES else "A"
+            next_channel = "A"
+            if b_every is not None and channel == "A":
+                sinceB += 1
+                if sinceB >= b_every:
+                    next_channel = "B"
+                    sinceB = 0
+            try:
+                value = self.read_long(self._channel_pulses(next_channel))
+            except HX711TimeoutError as e:
+                # keep trying, the chip may be powered down for a moment
+                self.sampling_error = e
+                continue
+            self._store_sample(channel, value)
+
+        if b_every is not None and self.pending_pulses == CHANNEL_B_PULSES:
+            # stopped with channel B selected, keep that sample and leave
+            # channel A selected for the reads after us
+            try:
+                self._store_sample("B", self.read_long())
+            except HX711TimeoutError as e:
+                self.sampling_error = e
+
+
+    def _ring(self, channel):
+        if channel not in self._rings:
+            raise ValueError("HX711::_ring(): channel %s is not sampled" % channel)
+        return self._rings[channel]
+
+
+    # the last `window` buffered samples of `channel` (all of them if None),
+    # oldest order not kept. Waits up to ready_timeout for the first sample.
+    def _buffered(self, window=None, channel="A"):
+        ring = self._ring(channel)
+        if not ring.filled.wait(self.ready_timeout):
+            raise HX711TimeoutError("HX711 on DOUT %s has not produced a channel %s sample" % (self.DOUT, channel))
+        with self._ringLock:
+            return ring.last(window)
+
+
+    # statistic of the buffered samples, in raw counts. The filter only sees
+    # channel A, channel B falls back to the median when sampling with
+    # method "filter".
+    def buffered_value(self, method=None, window=None, channel="A"):
+        if method is None:
+            method = self.sample_method
+            if method == "filter" and channel != "A":
+                method = "median"
+        if method == "filter" and channel != "A":
+            raise ValueError("HX711::buffered_value(): the filter only sees channel A")
+        if method == "ema" or method == "filter":
+            self._buffered(1, channel)
+            with self._ringLock:
+                return self._ring(channel).ema if method == "ema" else self.filter.value
+        values = self._buffered(window, channel)
+        if method == "median":
+            return float(np.median(values))
+        if method == "trimmed":
+            # drop 20% of the samples from either end, as read_average() does
+            values = np.sort(values)
+            trim = int(len(values) * 0.2)
+            return float(values[trim:len(values) - trim].mean())
+        raise ValueError("Unrecognised method: \"%s\"" % method)
+
+
+    # variance of the buffered samples, in raw counts squared
+    def sample_variance(self, window=None, channel="A"):
+        return float(np.var(self._buffered(window, channel)))
+
+
+    # seconds since the newest buffered sample was read
+    def sample_age(self, channel="A"):
+        self._buffered(1, channel)
+        with self._ringLock:
+            return time.monotonic() - self._ring(channel).newest_time()
+
+
+    # pauses the sampler around code that changes channel or gain
+    @contextmanager
+    def _sampling_suspended(self):
+        if not self.sampling:
+            yield
+            return
+        settings = (len(self._rings["A"].values), self.sample_method, self.ema_alpha, self.sample_b_every)
+        self.stop_sampling()
+        try:
+            yield
+        finally:
+            self.start_sampling(*settings)
 
 
     # Compatibility function, uses channel A version
@@ -229,16 +837,26 @@ class HX711:
         return self.get_value_A(times)
 
 
+    # `times` is ignored while sampling in the background
     def get_value_A(self, times=3):
-        return self.read_median(times) #-self.get_offset_A()
+        if self.sampling:
+            return self.buffered_value() - self.get_offset_A()
+        if self.filter is not None:
+            return self.read_filtered(times) - self.get_offset_A()
+        return self.read_median(times) - self.get_offset_A()
 
 
+    # uses the channel B buffer when it is sampled in the background,
+    # otherwise switches the gain, throwing a conversion away each way
     def get_value_B(self, times=3):
-        # for channel B, we need to set_gain(32)
-        g = self.get_gain()
-        self.set_gain(32)
-        value = self.read_median(times) - self.get_offset_B()
-        self.set_gain(g)
+        if self.sampling and "B" in self._rings:
+            return self.buffered_value(channel="B") - self.get_offset_B()
+        with self._sampling_suspended():
+            # for channel B, we need to set_gain(32)
+            g = self.get_gain()
+            self.set_gain(32)
+            value = self.read_median(times) - self.get_offset_B()
+            self.set_gain(g)
         return value
 
     # Compatibility function, uses channel A version
@@ -266,8 +884,10 @@ class HX711:
         # Backup REFERENCE_UNIT value
         backupReferenceUnit = self.get_reference_unit_A()
         self.set_reference_unit_A(1)
-        
-        value = self.read_average(times)
+
+        # the sampler would be clocking the chip at the same time
+        with self._sampling_suspended():
+            value = self.read_average(times)
 
         if self.DEBUG_PRINTING:
             print("Tare A value:", value)
@@ -285,19 +905,20 @@ class HX711:
         backupReferenceUnit = self.get_reference_unit_B()
         self.set_reference_unit_B(1)
 
-        # for channel B, we need to set_gain(32)
-        backupGain = self.get_gain()
-        self.set_gain(32)
+        with self._sampling_suspended():
+            # for channel B, we need to set_gain(32)
+            backupGain = self.get_gain()
+            self.set_gain(32)
 
-        value = self.read_average(times)
+            value = self.read_average(times)
 
-        if self.DEBUG_PRINTING:
-            print("Tare B value:", value)
-        
-        self.set_offset_B(value)
+            if self.DEBUG_PRINTING:
+                print("Tare B value:", value)
 
-        # Restore gain/channel/reference unit settings.
-        self.set_gain(backupGain)
+            self.set_offset_B(value)
+
+            # Restore gain/channel/reference unit settings.
+            self.set_gain(backupGain)
         self.set_reference_unit_B(backupReferenceUnit)
        
         return value
@@ -366,7 +987,7 @@ class HX711:
 
 
     def get_reference_unit(self):
-        return get_reference_unit_A()
+        return self.get_reference_unit_A()
 
         
     def get_reference_unit_A(self):
@@ -385,8 +1006,8 @@ class HX711:
         # Cause a rising edge on HX711 Digital Serial Clock (PD_SCK).  We then
         # leave it held up and wait 100 us.  After 60us the HX711 should be
         # powered down.
-        GPIO.output(self.PD_SCK, False)
-        GPIO.output(self.PD_SCK, True)
+        self.gpio.set_clock(False)
+        self.gpio.set_clock(True)
 
         time.sleep(0.0001)
 
@@ -401,10 +1022,11 @@ class HX711:
         self.readLock.acquire()
 
         # Lower the HX711 Digital Serial Clock (PD_SCK) line.
-        GPIO.output(self.PD_SCK, False)
+        self.gpio.set_clock(False)
 
         # Wait 100 us for the HX711 to power back up.
         time.sleep(0.0001)
+        self.pending_pulses = 1
 
         # Release the Read Lock, now that we've finished driving the HX711
         # serial interface.
@@ -423,4 +1045,175 @@ class HX711:
         self.power_up()
 
 
+# weight of each of the 24 bits of a word, MSB first
+BIT_WEIGHTS = 1 << np.arange(23, -1, -1, dtype=np.int64)
+
+
+# Several HX711s (e.g. one per corner load cell of a hive scale) with their
+# own DOUT pins and one shared PD_SCK. Every clock samples all the DOUT pins
+# at once, so the N words come out of one 24 bit pass and a readout takes as
+# long as with a single chip. All the chips share the gain, as they see the
+# same trailing pulses. Values and weights are numpy arrays with one entry
+# per cell, in the order of `douts`.
+class HX711Multi:
+
+    settle_time = 1.0
+
+    def __init__(self, douts, pd_sck, gain=128, backend=None, ready_timeout=1.0):
+        if not douts:
+            raise ValueError("HX711Multi(): at least one DOUT pin is needed")
+        self.DOUTS = list(douts)
+        self.PD_SCK = pd_sck
+        self.ready_timeout = ready_timeout
+        self.readLock = threading.Lock()
+
+        if backend is None:
+            backend = RPiGPIOBackend()
+        elif isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise ValueError("Unrecognised backend: \"%s\"" % backend)
+            backend = BACKENDS[backend]()
+        self.gpio = backend
+        self.gpio.setup_multi(self.DOUTS, self.PD_SCK)
+
+        cells = len(self.DOUTS)
+        self._shifts = np.arange(cells, dtype=np.int64)
+        self.GAIN = 0
+        self.OFFSETS = np.zeros(cells, dtype=np.float64)
+        self.REFERENCE_UNITS = np.ones(cells, dtype=np.float64)
+        self.lastVals = np.zeros(cells, dtype=np.int64)
+
+        self.set_gain(gain)
+        time.sleep(self.settle_time)
+
+
+    @property
+    def cells(self):
+        return len(self.DOUTS)
+
+
+    def is_ready(self):
+        return self.gpio.read_douts() == 0
+
+
+    def set_gain(self, gain):
+        if gain == 128:
+            self.GAIN = 1
+        elif gain == 64:
+            self.GAIN = 3
+        elif gain == 32:
+            self.GAIN = 2
+        else:
+            raise ValueError("Unrecognised gain: \"%s\"" % gain)
+
+        self.gpio.set_clock(False)
+
+        # Read out a set of samples and throw it away.
+        self.read_longs()
+
+
+    def get_gain(self):
+        return {1: 128, 3: 64, 2: 32}.get(self.GAIN, 0)
+
+
+    # One signed sample from every chip. Waits for all of them to have a
+    # conversion ready, then clocks them out together.
+    def read_longs(self):
+        self.readLock.acquire()
+        try:
+            if not self.gpio.wait_for_all_ready(self.ready_timeout):
+                raise HX711TimeoutError("HX711 on DOUT %s not ready after %ss, is it connected?"
+                                        % (self.DOUTS, self.ready_timeout))
+            masks = self.gpio.clock_bits_multi(24)
+            self.gpio.clock_bits_multi(self.GAIN)
+        finally:
+            self.readLock.release()
+
+        # (24, cells) bits, then the words of all the cells at once
+        bits = (np.array(masks, dtype=np.int64)[:, None] >> self._shifts) & 1
+        words = BIT_WEIGHTS @ bits
+        self.lastVals = words - ((words & 0x800000) << 1)
+        return self.lastVals
+
+
+    # per cell median of `times` samples
+    def read_median(self, times=3):
+        if times <= 0:
+            raise ValueError("HX711Multi::read_median(): times must be greater than zero!")
+        return np.median([self.read_longs() for x in range(times)], axis=0)
+
+
+    # per cell mean of `times` samples without the top and bottom 20%, like
+    # HX711.read_average()
+    def read_average(self, times=15):
+        if times <= 0:
+            raise ValueError("HX711Multi::read_average(): times must be greater than zero!")
+        if times < 5:
+            return self.read_median(times)
+        samples = np.sort([self.read_longs() for x in range(times)], axis=0)
+        trimAmount = int(times * 0.2)
+        return samples[trimAmount:times - trimAmount].mean(axis=0)
+
+
+    def get_values(self, times=3):
+        return self.read_median(times) - self.OFFSETS
+
+
+    # Returns (per cell weights, total weight). The cells' share of the total
+    # shows how the hive sits on the scale.
+    def get_weights(self, times=3):
+        weights = self.get_values(times) / self.REFERENCE_UNITS
+        return weights, float(weights.sum())
+
+
+    def get_weight(self, times=3):
+        return self.get_weights(times)[1]
+
+
+    # tares every cell at once, the scale must be empty
+    def tare(self, times=15):
+        self.OFFSETS = np.asarray(self.read_average(times), dtype=np.float64)
+        return self.OFFSETS
+
+
+    # offsets and reference units take a value per cell or one for all
+    def set_offsets(self, offsets):
+        self.OFFSETS = np.broadcast_to(np.asarray(offsets, dtype=np.float64), (self.cells,)).copy()
+
+    def get_offsets(self):
+        return self.OFFSETS
+
+    def set_reference_units(self, reference_units):
+        reference_units = np.broadcast_to(np.asarray(reference_units, dtype=np.float64), (self.cells,)).copy()
+        if np.any(reference_units == 0):
+            raise ValueError("HX711Multi::set_reference_units() can't accept 0 as a reference unit!")
+        self.REFERENCE_UNITS = reference_units
+
+    def get_reference_units(self):
+        return self.REFERENCE_UNITS
+
+
+    # PD_SCK is shared, so these power all the chips down and up together
+    def power_down(self):
+        with self.readLock:
+            self.gpio.set_clock(False)
+            self.gpio.set_clock(True)
+            time.sleep(0.0001)
+
+
+    def power_up(self):
+        with self.readLock:
+            self.gpio.set_clock(False)
+            time.sleep(0.0001)
+
+        # back on channel A gain 128, see HX711.power_up()
+        if self.get_gain() != 128:
+            self.read_longs()
+
+
+    def reset(self):
+        self.power_down()
+        self.power_up()
+
+
 # EOF - hx711.py
@@ -0,0 +1,113 @@
+import time
+
+# SCD41 CO2 sensor kept open and configured across capture cycles. The
+# sensor is set up once per session (measurement stopped, automatic self
+# calibration set) and every read() then waits only for the conversion,
+# polling get_data_ready_status() rather than sleeping a fixed time:
+#
+#   "single_shot"  measure_single_shot() on every read, ~5s per reading and
+#                  idle in between, for a cycle every few minutes or more
+#   "low_power"    low power periodic measurement, a reading every 30s
+#                  without being asked, for cycles that come more often
+#
+# sensirion_i2c_scd is imported on open(), so a missing library only fails
+# the CO2 reading.
+
+MODES = ("single_shot", "low_power")
+
+
+class SCD41:
+
+    # asc:           automatic self calibration, the sensor then takes the
+    #                lowest reading of the past week as 400ppm. It is only
+    #                written (and persisted to the sensor's EEPROM) when it
+    #                differs from what the sensor has.
+    # ready_timeout: seconds read() waits for a conversion, None for the
+    #                mode's period plus a margin
+    def __init__(self, device="/dev/i2c-1", mode="single_shot", asc=True, ready_timeout=None,
+                 poll_interval=0.1):
+        if mode not in MODES:
+            raise ValueError("Unrecognised mode: \"%s\"" % mode)
+        self.device = device
+        self.mode = mode
+        self.asc = asc
+        if ready_timeout is None:
+            ready_timeout = 10.0 if mode == "single_shot" else 40.0
+        self.ready_timeout = ready_timeout
+        self.poll_interval = poll_interval
+        self._transceiver = None
+        self.scd41 = None
+
+    @property
+    def is_open(self):
+        return self.scd41 is not None
+
+    def open(self):
+        if self.is_open:
+            return
+        from sensirion_i2c_scd import Scd4xI2cDevice
+        from sensirion_i2c_scd.scd4x.data_types import Scd4xPowerMode
+        from sensirion_i2c_driver import LinuxI2cTransceiver, I2cConnection
+
+        # opens the device file
+        self._transceiver = LinuxI2cTransceiver(self.device)
+        try:
+            scd41 = Scd4xI2cDevice(I2cConnection(self._transceiver))
+            # a previous run may have left it measuring, and settings can
+            # only be changed while it is idle
+            # (the driver waits the 500ms the sensor needs to stop)
+            scd41.stop_periodic_measurement()
+            if scd41.get_automatic_self_calibration() != self.asc:
+                scd41.set_automatic_self_calibration(self.asc)
+                scd41.persist_settings()
+            if self.mode == "low_power":
+                scd41.start_periodic_measurement(Scd4xPowerMode.LOW)
+        except Exception:
+            self._transceiver.close()
+            self._transceiver = None
+            raise
+        self.scd41 = scd41
+
+    def close(self):
+        if not self.is_open:
+            return
+        try:
+            if self.mode == "low_power":
+                self.scd41.stop_periodic_measurement()
+        finally:
+            self.scd41 = None
+            self._transceiver.close()
+            self._transceiver = None
+
+    def _wait_for_data(self):
+        deadline = time.monotonic() + self.ready_timeout
+        while not self.scd41.get_data_ready_status():
+            if time.monotonic() >= deadline:
+                raise TimeoutError("SCD41 on %s has no reading after %ss" % (self.device, self.ready_timeout))
+            time.sleep(self.poll_interval)
+
+    # Returns (CO2 in ppm, temperature in C, relative humidity in %). Opens
+    # the session if needed; on an error it is closed, so the next read
+    # sets the sensor up again.
+    def read(self):
+        self.open()
+        try:
+            if self.mode == "single_shot":
+                # returns after the command's 5s execution time
+                self.scd41.measure_single_shot()
+            self._wait_for_data()
+            co2, temperature, humidity = self.scd41.read_measurement()
+        except Exception:
+            try:
+                self.close()
+            except Exception:
+                pass
+            raise
+        return co2.co2, temperature.degrees_celsius, humidity.percent_rh
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,83 @@
+# Times the stages of a vibration capture against the emulated ADXL345, so
+# changes to the acquisition and processing code can be compared on any
+# machine:
+#
+#   python3 benchmark.py                  # 10000 samples, 5 repeats
+#   python3 benchmark.py -n 20000 -r 10
+#
+# The emulator runs unthrottled, so the acquisition figures are the Python
+# side cost of a capture (what a Pi Zero spends on CPU), not bus time.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+os.environ.setdefault("EMULATE_ADXL345", "1")
+
+import numpy as np
+import vibration
+from processing import VibrationProcessor, Decimator
+import spectral_log
+import raw_archive
+
+
+def timed(function, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000.0, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vibration capture stages")
+    parser.add_argument("-n", "--samples", type=int, default=vibration.samples_to_read)
+    parser.add_argument("-r", "--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if not vibration.EMULATE_ADXL345:
+        print("EMULATE_ADXL345 is empty, the benchmark only runs against the emulator")
+        sys.exit(1)
+
+    n = args.samples
+    adxl345 = vibration.ADXL345()
+    adxl345.setBandwidthRate(vibration.fifo_rate)
+    processor = VibrationProcessor(n, adxl345.getOutputDataRate())
+    out_dir = tempfile.mkdtemp()
+
+    results = []
+    ms, capture = timed(lambda: adxl345.captureFifo(n, True, out=processor.buffer), args.repeats)
+    results.append(("captureFifo", ms))
+    ms, _ = timed(lambda: vibration.decode_frames(capture.raw, True, processor.buffer), args.repeats)
+    results.append(("decode_frames", ms))
+    ms, _ = timed(lambda: adxl345.readAxes(n, True), args.repeats)
+    results.append(("readAxes", ms))
+    ms, _ = timed(lambda: [adxl345.getAxes(True) for _ in range(n)], 1)
+    results.append(("getAxes x N", ms))
+    decimator = Decimator(2)
+    ms, _ = timed(lambda: decimator.process(capture.axes), args.repeats)
+    results.append(("decimate x2", ms))
+    ms, result = timed(lambda: processor.process(capture.axes), args.repeats)
+    results.append(("process", ms))
+
+    log_path = os.path.join(out_dir, "capture" + spectral_log.EXTENSION)
+    ms, _ = timed(lambda: spectral_log.write_spectral_log(log_path, 0, "benchmark", result.sample_rate, n,
+                                                          result.signal, result.magnitude), args.repeats)
+    results.append(("write_spectral_log", ms))
+    ms, _ = timed(lambda: spectral_log.write_legacy_csv(os.path.join(out_dir, "capture.csv"), result.sample_rate, n,
+                                                        result.signal, result.magnitude), args.repeats)
+    results.append(("write_legacy_csv", ms))
+    archive_path = os.path.join(out_dir, "capture" + raw_archive.EXTENSION)
+    ms, _ = timed(lambda: raw_archive.write_raw_archive(archive_path, 0, "benchmark", result.sample_rate,
+                                                        adxl345.range_flag, vibration.SCALE_MULTIPLIER, capture.raw),
+                  args.repeats)
+    results.append(("write_raw_archive", ms))
+
+    print("%s samples per axis, best of %s" % (n, args.repeats))
+    for name, ms in results:
+        print("  %-20s %9.2f ms" % (name, ms))
+    print("  peak frequencies: %s Hz" % ", ".join("%.1f" % f for f in result.frequencies[np.argmax(result.magnitude, axis=1)]))
@@ -0,0 +1,252 @@
+import time
+import numpy as np
+from collections import deque
+
+# Emulated smbus.SMBus with an ADXL345 behind it, so the vibration code can be
+# run, timed and regression tested without a Pi. It implements the registers
+# vibration.py uses: DEVID, BW_RATE, POWER_CTL, INT_SOURCE, DATA_FORMAT, the
+# six AXES_DATA registers, the FIFO (FIFO_CTL / FIFO_STATUS) and activity
+# detection (THRESH_ACT, ACT_INACT_CTL, INT_ENABLE).
+#
+# The signal is gravity plus a set of tones plus gaussian noise, plus optional
+# tone bursts to set off activity detection, quantised to
+# the 4mg/LSB full resolution counts and clipped to the selected range. It is
+# generated from a seeded RNG, so a given configuration always produces the
+# same samples.
+#
+# realtime=True  samples appear at the output data rate of the wall clock, the
+#                FIFO overruns if it is not drained fast enough and, with
+#                i2c_clock set, every transfer takes as long as on the bus.
+# realtime=False (unthrottled) the clock is virtual: the FIFO fills up to the
+#                watermark the moment its status is read, every data
+#                register read in bypass mode returns the next sample and,
+#                with activity detection on, every INT_SOURCE read moves on
+#                by a watermark's worth of samples.
+
+DEVID            = 0x00
+THRESH_ACT       = 0x24
+ACT_INACT_CTL    = 0x27
+INT_ENABLE       = 0x2E
+BW_RATE          = 0x2C
+POWER_CTL        = 0x2D
+INT_SOURCE       = 0x30
+DATA_FORMAT      = 0x31
+AXES_DATA        = 0x32
+FIFO_CTL         = 0x38
+FIFO_STATUS      = 0x39
+
+INT_DATA_READY   = 0x80
+INT_ACTIVITY     = 0x10
+INT_WATERMARK    = 0x02
+INT_OVERRUN      = 0x01
+
+FIFO_SIZE        = 32
+SCALE_MULTIPLIER = 0.004
+THRESH_ACT_SCALE = 0.0625
+CHUNK            = 1024
+
+OUTPUT_DATA_RATE_HZ = {0x0F: 3200.0, 0x0E: 1600.0, 0x0D: 800.0, 0x0C: 400.0, 0x0B: 200.0,
+                       0x0A: 100.0, 0x09: 50.0, 0x08: 25.0, 0x07: 12.5, 0x06: 6.25}
+
+
+class EmulatedSMBus:
+
+    # tones:   (axis, frequency Hz, amplitude g) triples
+    # noise:   standard deviation of the noise in g, per axis
+    # gravity: static acceleration per axis in g
+    # bursts:  (start s, duration s, axis, frequency Hz, amplitude g) tone
+    #          bursts, timed from when measurement is switched on
+    def __init__(self, bus = 1, address = 0x53, tones = ((0, 250.0, 0.05), (1, 120.0, 0.02), (2, 60.0, 0.01)),
+                 noise = 0.01, gravity = (0.0, 0.0, 1.0), realtime = False, i2c_clock = None, seed = 0,
+                 bursts = ()):
+        self.address = address
+        self.tones = tuple(tones)
+        self.bursts = tuple(bursts)
+        self.noise = noise
+        self.gravity = np.asarray(gravity, dtype=np.float64)
+        self.realtime = realtime
+        self.i2c_clock = i2c_clock
+        self.seed = seed
+
+        self.registers = bytearray(0x40)
+        self.registers[DEVID] = 0xE5
+        self.registers[BW_RATE] = 0x0A
+
+        self.fifo = deque()
+        self.overrun = False
+        self.transfers = 0
+        self._reset_clock()
+
+    # restarts the sample stream, as when measurement is switched on
+    def _reset_clock(self):
+        self._rng = np.random.default_rng(self.seed)
+        self._start = time.perf_counter()
+        self._generated = 0
+        self._chunk = np.zeros((0, 3), dtype='<i2')
+        self._chunk_start = 0
+        self._current = np.zeros(3, dtype='<i2')
+        self.fifo.clear()
+        self.overrun = False
+        self.activity = False
+        self._reference = None
+
+    def output_data_rate(self):
+        return OUTPUT_DATA_RATE_HZ.get(self.registers[BW_RATE] & 0x0F, 100.0)
+
+    def _range_g(self):
+        return 2 << (self.registers[DATA_FORMAT] & 0x03)
+
+    def _measuring(self):
+        return bool(self.registers[POWER_CTL] & 0x08)
+
+    def _fifo_mode(self):
+        return self.registers[FIFO_CTL] & 0xC0
+
+    def _watermark(self):
+        return self.registers[FIFO_CTL] & 0x1F
+
+    # counts for sample indices [start, start + count)
+    def _synthesise(self, start, count):
+        t = (np.arange(start, start + count) / self.output_data_rate())[:, None]
+        g = np.repeat(self.gravity[None, :], count, axis=0)
+        for axis, frequency, amplitude in self.tones:
+            g[:, axis] += amplitude * np.sin(2 * np.pi * frequency * t[:, 0])
+        for begin, duration, axis, frequency, amplitude in self.bursts:
+            active = (t[:, 0] >= begin) & (t[:, 0] < begin + duration)
+            g[active, axis] += amplitude * np.sin(2 * np.pi * frequency * t[active, 0])
+        if self.noise:
+            g += self._rng.normal(0.0, self.noise, size=(count, 3))
+        limit = self._range_g() / SCALE_MULTIPLIER
+        return np.clip(np.rint(g / SCALE_MULTIPLIER), -limit, limit - 1).astype('<i2')
+
+    # produces the next sample of the stream
+    def _next_sample(self):
+        offset = self._generated - self._chunk_start
+        if offset >= len(self._chunk):
+            self._chunk_start = self._generated
+            self._chunk = self._synthesise(self._generated, CHUNK)
+            offset = 0
+        self._generated += 1
+        self._current = self._chunk[offset]
+        if self.registers[INT_ENABLE] & INT_ACTIVITY:
+            self._detect_activity(self._current)
+        return self._current
+
+    # latches INT_ACTIVITY when an enabled axis is beyond THRESH_ACT, measured
+    # from the sample at which detection was enabled in AC coupled mode
+    def _detect_activity(self, sample):
+        control = self.registers[ACT_INACT_CTL]
+        if self._reference is None:
+            self._reference = sample.astype(np.int32) if control & 0x80 else np.zeros(3, dtype=np.int32)
+            return
+        threshold = self.registers[THRESH_ACT] * THRESH_ACT_SCALE / SCALE_MULTIPLIER
+        excess = np.abs(sample.astype(np.int32) - self._reference) > threshold
+        if any(excess[axis] for axis, bit in enumerate((0x40, 0x20, 0x10)) if control & bit):
+            self.activity = True
+
+    # pushes `count` new samples through the FIFO
+    def _advance(self, count):
+        mode = self._fifo_mode()
+        for _ in range(count):
+            sample = self._next_sample()
+            if mode == 0x00:
+                continue
+            if len(self.fifo) >= FIFO_SIZE:
+                self.overrun = True
+                if mode == 0x80:
+                    # stream mode drops the oldest sample
+                    self.fifo.popleft()
+                else:
+                    continue
+            self.fifo.append(sample)
+
+    # catches the sample stream up with the (wall or virtual) clock
+    def _update(self, register = None):
+        if not self._measuring():
+            return
+        if self.realtime:
+            due = int((time.perf_counter() - self._start) * self.output_data_rate())
+            if due > self._generated:
+                self._advance(due - self._generated)
+        elif register == INT_SOURCE and self.registers[INT_ENABLE] & INT_ACTIVITY:
+            # waiting for activity, every poll moves the clock on
+            self._advance(max(1, self._watermark()))
+        elif register == FIFO_STATUS or register == INT_SOURCE:
+            if self._fifo_mode() != 0x00 and len(self.fifo) < max(1, self._watermark()):
+                self._advance(max(1, self._watermark()) - len(self.fifo))
+
+    def _transfer(self, count):
+        self.transfers += 1
+        if self.realtime and self.i2c_clock:
+            # address, register, repeated start and data bytes, 9 clocks each
+            time.sleep((3 + count) * 9.0 / self.i2c_clock)
+
+    def _read_register(self, register):
+        if register == FIFO_STATUS:
+            return min(len(self.fifo), FIFO_SIZE) & 0x3F
+        if register == INT_SOURCE:
+            value = INT_DATA_READY
+            if self._fifo_mode() != 0x00 and len(self.fifo) >= self._watermark():
+                value |= INT_WATERMARK
+            if self.overrun:
+                value |= INT_OVERRUN
+            if self.activity:
+                # reading INT_SOURCE clears the latched activity flag
+                value |= INT_ACTIVITY
+                self.activity = False
+            return value
+        return self.registers[register]
+
+    def _read_axes(self):
+        if self._fifo_mode() != 0x00:
+            if not self.fifo and not self.realtime:
+                self._advance(1)
+            sample = self.fifo.popleft() if self.fifo else self._current
+            if len(self.fifo) < FIFO_SIZE:
+                self.overrun = False
+        elif self.realtime:
+            sample = self._current
+        else:
+            sample = self._next_sample()
+        return list(sample.tobytes())
+
+    ##### smbus.SMBus interface #####
+
+    def write_byte_data(self, address, register, value):
+        self._check_address(address)
+        self._transfer(1)
+        self._update()
+        was_measuring = self._measuring()
+        self.registers[register] = value & 0xFF
+        if register == POWER_CTL and self._measuring() and not was_measuring:
+            self._reset_clock()
+        elif register == INT_ENABLE:
+            # activity is measured from the next sample on
+            self._reference = None
+            self.activity = False
+        elif register == FIFO_CTL and self._fifo_mode() == 0x00:
+            # bypass mode empties the FIFO
+            self.fifo.clear()
+            self.overrun = False
+
+    def read_byte_data(self, address, register):
+        self._check_address(address)
+        self._transfer(1)
+        self._update(register)
+        return self._read_register(register)
+
+    def read_i2c_block_data(self, address, register, length):
+        self._check_address(address)
+        self._transfer(length)
+        self._update(register)
+        if register == AXES_DATA:
+            data = self._read_axes()
+            return (data + [0] * length)[:length]
+        return [self._read_register(r) for r in range(register, register + length)]
+
+    def close(self):
+        pass
+
+    def _check_address(self, address):
+        if address != self.address:
+            raise OSError(121, "Remote I/O error")
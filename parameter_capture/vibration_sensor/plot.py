@@ -1,165 +1,159 @@
-from scipy import fftpack
+import os
+import sys
+import argparse
 import numpy as np
-import string
-import matplotlib.pyplot as plt
-
-sample_rate = 1030    # Sampling frequency.
-
-# def simpleParse(mainString, beginString, endString ):
-#     #Search for a substring between beginString and endString
-#     posBeginString = string.find(mainString, beginString) + len(beginString)
-#     posEndString = string.find(mainString, endString)
-#     result = mainString[posBeginString:posEndString]
-#     return result
-
-def simpleParse(mainString, beginString, endString ):
-    # Ensure mainString is a string
-    mainString = str(mainString)
-    # Search for a substring between beginString and endString
-    posBeginString = mainString.find(beginString) + len(beginString)
-    posEndString = mainString.find(endString)
-    result = mainString[posBeginString:posEndString]
-    return result
-
-def extract_int_tag(data_arch, tag):
-    #Extracts data from string data_str, delimited by <tag> y </tag> and converts it to integer numbers.
-    str_channel = ''
-    beginString = '<' + tag + '>'
-    endString = '</'+ tag + '>'
-    str_parse = simpleParse(data_arch, beginString, endString )
-    str_channel = str_parse.split(',')    
-    channel = []
-    n = len(str_channel)
-    for i in range(n):
-        channel.append(float(str_channel[i]))
-    return channel
-	
-# name_archive = raw_input('File to open: ')
-# name_archive += ".txt"
-name_archive = "/home/pi/Desktop/HiveMonitor2/VIBRATIONSENSOR/textfile/textfile_04-11-2023__20_21_12.txt"
-print('Opening file: ' + name_archive)
-archive = name_archive
-
-# Open file for reading
-arch = open(archive, "rb")
-data_arch = arch.read()
-
-channel_1 = extract_int_tag(data_arch, 'L1')
-channel_2 = extract_int_tag(data_arch, 'L2')
-channel_3 = extract_int_tag(data_arch, 'L3')
-
-print("Amount of samples in channel 1: %s" %len(channel_1))
-print("Amount of samples in channel 2: %s" %len(channel_2))
-print("Amount of samples in channel 3: %s" %len(channel_3))
-
-num_data = len(channel_1)
-X = range(0, num_data, 1)
-
-# Calculate medium value for each channel.
-vdc_channel_1 = 0
-vdc_channel_2 = 0
-vdc_channel_3 = 0
-for indice in X:
-    vdc_channel_1 += channel_1[indice]
-    vdc_channel_2 += channel_2[indice]
-    vdc_channel_3 += channel_3[indice]
-vdc_channel_1 = vdc_channel_1 / num_data
-vdc_channel_2 = vdc_channel_2 / num_data
-vdc_channel_3 = vdc_channel_3 / num_data
-print("Vdc Channel 1: {0}, Vdc Channel 2 {1}, Vdc Channel 3 {2}".format(vdc_channel_1, vdc_channel_2, vdc_channel_3))
-
-# Subtract DC offset
-for indice in X:
-    channel_1[indice] -= vdc_channel_1
-    channel_2[indice] -= vdc_channel_2
-    channel_3[indice] -= vdc_channel_3
-
-#----------------- Plotting -----------------
-stime = sample_rate/1000;
-X1 = np.linspace(0, num_data/stime, num=num_data) 
-fig1 = plt.figure(num=1, figsize=(10,7))
-fig1.suptitle('Sampled signal - Acceleration')
-
-# Figure 1. Sampled signals.
-
-# Channel X
-ax = fig1.add_subplot(3,1,1)
-ax.plot(X1,channel_1)
-ax.set_title("Channel X")
-ax.set_xlabel('ms')
-ax.set_ylabel('g')
-ax.grid()
-
-#Channel Y
-ax = fig1.add_subplot(3,1,2)
-ax.plot(X1,channel_2)
-ax.set_title("Channel Y")
-ax.set_xlabel('ms')
-ax.set_ylabel('g')
-ax.grid()
-
-#Channel Z
-ax = fig1.add_subplot(3,1,3)
-ax.plot(X1,channel_3)
-ax.set_title("Channel Z")
-ax.set_xlabel('ms')
-ax.set_ylabel('g')
-ax.grid()
-
-# Figure 2. FFT from signals.
-fig2 = plt.figure(num=2, figsize=(10,7))
-fig2.suptitle('FFT spectrum')
-
-#Channel X
-channel_fft = []
-channel_fft = channel_1
-
-N = len(channel_fft) # length of the signal
-T = 1.0 / sample_rate
-y = channel_fft
-yf = fftpack.fft(y)
-xf = np.linspace(0.0, 1.0/(2.0*T), int(N/2))
-
-
-ax = fig2.add_subplot(3,1,1)
-ax.plot(xf, 2.0/N * np.abs(yf[:int(N/2)]))
-ax.grid()
-ax.set_title("Channel X")
-ax.set_xlabel('Hz')
-ax.set_ylabel('g')
-
-#Channel Y
-channel_fft = []
-channel_fft = channel_2
-
-N = len(channel_fft) # length of the signal
-T = 1.0 / sample_rate
-y = channel_fft
-yf = fftpack.fft(y)
-xf = np.linspace(0.0, 1.0/(2.0*T), int(N/2))
-
-ax = fig2.add_subplot(3,1,2)
-ax.plot(xf, 2.0/N * np.abs(yf[:int(N/2)]))
-ax.grid()
-ax.set_title("Channel Y")
-ax.set_xlabel('Hz')
-ax.set_ylabel('g')
-
-#Channel Z
-channel_fft = []
-channel_fft = channel_3
-
-N = len(channel_fft) # length of the signal
-T = 1.0 / sample_rate
-y = channel_fft
-yf = fftpack.fft(y)
-xf = np.linspace(0.0, 1.0/(2.0*T), int(N/2))
-
-ax = fig2.add_subplot(3,1,3)
-ax.plot(xf, 2.0/N * np.abs(yf[:int(N/2)]))
-ax.grid()
-ax.set_title("Channel Z")
-ax.set_xlabel('Hz')
-ax.set_ylabel('g')
-
-plt.show()
\ No newline at end of file
+from concurrent.futures import ProcessPoolExecutor
+
+# Render headless, this runs on nodes and servers without a display
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from processing import VibrationProcessor
+from tagged_text import load_tagged_file
+import raw_archive
+
+sample_rate = 1030    # Sampling frequency of the legacy text files.
+
+# roughly the number of points drawn per trace, see decimate_minmax()
+max_points = 2000
+
+CAPTURE_EXTENSIONS = (".txt", raw_archive.EXTENSION)
+AXES = ("Channel X", "Channel Y", "Channel Z")
+
+
+# Reduces x/y to at most ~`points` points by keeping the minimum and maximum
+# of each bucket in their original order. Every peak that would be visible at
+# that width survives, which plain striding does not guarantee.
+def decimate_minmax(x, y, points = max_points):
+    n = len(y)
+    buckets = points // 2
+    if n <= points or buckets < 1:
+        return x, y
+
+    # round the bucket size up so the leftover tail is shorter than a bucket
+    size = -(-n // buckets)
+    buckets = n // size
+    usable = size * buckets
+    blocks = y[:usable].reshape(buckets, size)
+    lo = blocks.argmin(axis=1)
+    hi = blocks.argmax(axis=1)
+
+    offsets = np.arange(buckets) * size
+    index = np.empty((buckets, 2), dtype=np.int64)
+    index[:, 0] = np.minimum(lo, hi) + offsets
+    index[:, 1] = np.maximum(lo, hi) + offsets
+    index = index.ravel()
+    if usable < n:
+        # the short last bucket, keep its extremes too
+        tail = y[usable:]
+        index = np.concatenate((index, np.sort([usable + tail.argmin(), usable + tail.argmax()])))
+
+    return x[index], y[index]
+
+
+# returns (3, N) samples in g and their sample rate
+def load_capture(path):
+    if path.endswith(raw_archive.EXTENSION):
+        archive = raw_archive.open_raw_archive(path)
+        return raw_archive.archive_to_axes(archive), archive.sample_rate
+    return np.array(load_tagged_file(path)), sample_rate
+
+
+def _plot_axes(figure, x, channels, xlabel, ylabel):
+    for index, channel in enumerate(channels):
+        ax = figure.add_subplot(3, 1, index + 1)
+        ax.plot(*decimate_minmax(x, channel), linewidth=0.6)
+        ax.set_title(AXES[index])
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.grid()
+    figure.tight_layout()
+
+
+# Renders the time domain and FFT figures of one capture into output_dir and
+# returns the two PNG paths.
+def render_capture(path, output_dir, dpi = 100):
+    samples, rate = load_capture(path)
+    result = VibrationProcessor(samples.shape[1], rate).process(samples)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    signal_png = os.path.join(output_dir, name + "_signal.png")
+    fft_png = os.path.join(output_dir, name + "_fft.png")
+
+    # Figure 1. Sampled signals, time in ms
+    figure = Figure(figsize=(10, 7))
+    FigureCanvasAgg(figure)
+    figure.suptitle('Sampled signal - Acceleration')
+    time_ms = np.arange(samples.shape[1]) * (1000.0 / rate)
+    _plot_axes(figure, time_ms, result.signal, 'ms', 'g')
+    figure.savefig(signal_png, dpi=dpi)
+
+    # Figure 2. FFT from signals.
+    figure = Figure(figsize=(10, 7))
+    FigureCanvasAgg(figure)
+    figure.suptitle('FFT spectrum')
+    _plot_axes(figure, result.frequencies, result.magnitude, 'Hz', 'g')
+    figure.savefig(fft_png, dpi=dpi)
+
+    return signal_png, fft_png
+
+
+def _render_job(job):
+    path, output_dir = job
+    try:
+        render_capture(path, output_dir)
+        return path, None
+    except Exception as e:
+        return path, str(e)
+
+
+# expands files and directories into the capture files they contain
+def find_captures(paths):
+    captures = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(CAPTURE_EXTENSIONS):
+                    captures.append(os.path.join(path, name))
+        else:
+            captures.append(path)
+    return captures
+
+
+# Renders every capture in a process pool (all cores unless workers is set).
+# Captures whose PNGs are newer than the capture file are skipped unless
+# force is set. Returns a list of (path, error) for the failed ones.
+def render_all(paths, output_dir, workers = None, force = False):
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for path in find_captures(paths):
+        name = os.path.splitext(os.path.basename(path))[0]
+        fft_png = os.path.join(output_dir, name + "_fft.png")
+        if not force and os.path.exists(fft_png) and os.path.getmtime(fft_png) >= os.path.getmtime(path):
+            continue
+        jobs.append((path, output_dir))
+
+    print("Rendering %s captures" % len(jobs))
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, error in pool.map(_render_job, jobs, chunksize=4):
+            if error is None:
+                print("Rendered " + path)
+            else:
+                print("FAILED %s: %s" % (path, error))
+                failed.append((path, error))
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render vibration captures to PNG")
+    parser.add_argument("paths", nargs="+", help="capture files or directories of captures")
+    parser.add_argument("-o", "--output", default="plots", help="directory the PNGs are written to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-f", "--force", action="store_true", help="re-render captures that already have plots")
+    args = parser.parse_args()
+
+    failed = render_all(args.paths, args.output, args.workers, args.force)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,181 @@
+import numpy as np
+from collections import namedtuple
+
+# Result of VibrationProcessor.process().
+#   signal      (3, N) detrended samples, one row per axis
+#   dc_offset   (3,) mean that was removed from each axis
+#   frequencies (N/2,) frequency of every spectrum bin in Hz
+#   magnitude   (3, N/2) single sided amplitude spectrum, same unit as signal
+#   sample_rate rate in Hz the spectrum was computed for
+# The arrays are the processor's own buffers and get overwritten by the next
+# call to process(), copy them if they have to outlive it.
+SpectrumResult = namedtuple("SpectrumResult", ["signal", "dc_offset", "frequencies", "magnitude", "sample_rate"])
+
+WINDOWS = {
+    "boxcar": np.ones,
+    "hann": np.hanning,
+    "hamming": np.hamming,
+    "blackman": np.blackman,
+}
+
+
+class VibrationProcessor:
+
+    # samples: number of samples per axis in a capture
+    # window:  one of WINDOWS, "boxcar" keeps the plain FFT of the old code
+    # detrend: "constant" removes the mean, "linear" a straight line fit
+    def __init__(self, samples, sample_rate, window = "boxcar", detrend = "constant"):
+        if window not in WINDOWS:
+            raise ValueError("Unrecognised window: \"%s\"" % window)
+        if detrend not in ("constant", "linear"):
+            raise ValueError("Unrecognised detrend: \"%s\"" % detrend)
+
+        # scipy is only needed once there is something to transform
+        from scipy import fft
+        self._rfft = fft.rfft
+
+        self.samples = samples
+        self.bins = samples // 2
+        self.detrend = detrend
+        self.sample_rate = None
+
+        # capture buffer, acquisition code writes straight into this
+        self.buffer = np.zeros((3, samples), dtype=np.float32)
+
+        self._windowed = np.empty((3, samples), dtype=np.float32)
+        self._magnitude = np.empty((3, self.bins), dtype=np.float32)
+        self._dc_offset = np.empty((3, 1), dtype=np.float32)
+        self._slope = np.empty(3, dtype=np.float32)
+
+        self.window = WINDOWS[window](samples).astype(np.float32)
+        # amplitude correction so a sine of amplitude A shows up as A whatever
+        # the window; for boxcar this is the usual 2/N
+        self.scale = np.float32(2.0 / self.window.sum())
+
+        # centred time index used by the linear detrend
+        self._ramp = (np.arange(samples, dtype=np.float32) - (samples - 1) / 2.0)
+        self._ramp_norm = np.float32(np.dot(self._ramp, self._ramp))
+
+        self.set_sample_rate(sample_rate)
+
+    def set_sample_rate(self, sample_rate):
+        if sample_rate == self.sample_rate:
+            return
+        self.sample_rate = float(sample_rate)
+        self.frequencies = np.arange(self.bins, dtype=np.float32) * np.float32(self.sample_rate / self.samples)
+
+    # Detrends, windows and transforms the three axes in one go.
+    # data is an optional (3, N) array to process instead of self.buffer.
+    def process(self, data = None, sample_rate = None):
+        if data is not None:
+            np.copyto(self.buffer, data, casting='same_kind')
+        if sample_rate is not None:
+            self.set_sample_rate(sample_rate)
+
+        signal = self.buffer
+
+        # remove the DC offset of every axis in place
+        np.mean(signal, axis=1, keepdims=True, out=self._dc_offset)
+        signal -= self._dc_offset
+
+        if self.detrend == "linear":
+            np.dot(signal, self._ramp, out=self._slope)
+            self._slope /= self._ramp_norm
+            np.multiply(self._slope[:, None], self._ramp, out=self._windowed)
+            signal -= self._windowed
+
+        np.multiply(signal, self.window, out=self._windowed)
+
+        # one real input FFT across all axes, float32 in gives complex64 out
+        spectrum = self._rfft(self._windowed, axis=1, overwrite_x=True)
+        np.abs(spectrum[:, :self.bins], out=self._magnitude)
+        self._magnitude *= self.scale
+
+        return SpectrumResult(signal, self._dc_offset[:, 0], self.frequencies, self._magnitude, self.sample_rate)
+
+
+# Anti-aliased decimation by an integer factor, to oversample at a high output
+# data rate and keep only the band of interest. A linear phase FIR low pass
+# is applied in polyphase form (scipy's upfirdn), so only the output samples
+# that are kept get computed, and the filter delay is removed so decimated
+# sample i lines up with input sample i * factor.
+class Decimator:
+
+    # factor:   integer decimation factor, 1 passes samples through
+    # cutoff:   passband edge as a fraction of the output Nyquist frequency
+    # taps_per_phase: filter length per polyphase branch, longer is sharper
+    def __init__(self, factor, cutoff = 0.8, taps_per_phase = 16):
+        if factor < 1 or int(factor) != factor:
+            raise ValueError("Decimation factor must be a positive integer: %s" % factor)
+        self.factor = int(factor)
+        self.taps = None
+        if self.factor == 1:
+            return
+
+        from scipy import signal
+        self._upfirdn = signal.upfirdn
+        # odd length with the centre tap on a multiple of factor, so the
+        # delay is a whole number of output samples
+        self.delay = taps_per_phase // 2
+        numtaps = 2 * self.delay * self.factor + 1
+        self.taps = signal.firwin(numtaps, cutoff / self.factor, window=("kaiser", 8.0))
+
+    def output_rate(self, rate):
+        return rate / self.factor
+
+    def output_length(self, samples):
+        return -(-samples // self.factor)
+
+    # decimates (3, N) samples along the last axis into out, if given, of
+    # shape (3, output_length(N))
+    def process(self, samples, out = None):
+        if self.factor == 1:
+            if out is None:
+                return samples
+            np.copyto(out, samples, casting='same_kind')
+            return out
+        n = self.output_length(samples.shape[-1])
+        filtered = self._upfirdn(self.taps, samples, 1, self.factor, axis=-1)
+        if out is None:
+            out = np.empty(samples.shape[:-1] + (n,), dtype=np.float32)
+        np.copyto(out, filtered[..., self.delay:self.delay + n], casting='same_kind')
+        return out
+
+
+# Timing statistics of a capture from its per-sample timestamps in ns.
+# Intervals and jitter (deviation of each interval from the mean interval)
+# are reported in microseconds.
+def timing_stats(timestamps_ns, target_rate = None):
+    stamps = np.asarray(timestamps_ns, dtype=np.int64)
+    intervals = np.diff(stamps) / 1000.0
+    duration = (stamps[-1] - stamps[0]) / 1e9
+    jitter = np.abs(intervals - intervals.mean())
+    stats = {
+        "samples": int(len(stamps)),
+        "duration_s": float(duration),
+        "achieved_rate_hz": float((len(stamps) - 1) / duration) if duration > 0 else 0.0,
+        "interval_mean_us": float(intervals.mean()),
+        "interval_min_us": float(intervals.min()),
+        "interval_max_us": float(intervals.max()),
+        "jitter_rms_us": float(np.sqrt(np.mean(jitter ** 2))),
+        "jitter_p50_us": float(np.percentile(jitter, 50)),
+        "jitter_p95_us": float(np.percentile(jitter, 95)),
+        "jitter_p99_us": float(np.percentile(jitter, 99)),
+        "jitter_max_us": float(jitter.max()),
+    }
+    if target_rate:
+        stats["target_rate_hz"] = float(target_rate)
+    return stats
+
+
+# Linearly interpolates irregularly timed (3, N) samples onto a uniform grid
+# of N points at `rate` Hz starting at the first timestamp, into out (which
+# may not be samples itself).
+def resample_uniform(samples, timestamps_ns, rate, out = None):
+    if out is None:
+        out = np.empty(samples.shape, dtype=np.float32)
+    stamps = (np.asarray(timestamps_ns, dtype=np.int64) - timestamps_ns[0]) / 1e9
+    grid = np.arange(samples.shape[1]) / float(rate)
+    for axis in range(samples.shape[0]):
+        out[axis] = np.interp(grid, stamps, samples[axis])
+    return out
@@ -0,0 +1,71 @@
+import sys
+import struct
+import numpy as np
+from collections import namedtuple
+
+# Lossless archive of a vibration capture as the raw ADXL345 counts.
+#
+# Layout (little endian):
+#   header  magic "HMRA", version (u8), range flag (u8), reserved (u16),
+#           scale in g per count (f64), sample rate (f64), samples N (u32),
+#           node id (16 bytes, NUL padded), timestamp (24 bytes, NUL padded)
+#   data    N frames of int16 x, y, z exactly as read from the data registers
+# The header has a fixed size so the data can be memory mapped directly.
+
+MAGIC = b"HMRA"
+VERSION = 1
+EXTENSION = ".hmra"
+
+HEADER = struct.Struct("<4sBBHddI16s24s")
+
+# full scale range in g for the DATA_FORMAT range flags
+RANGE_G = {0x00: 2, 0x01: 4, 0x02: 8, 0x03: 16}
+
+# counts is a read-only (N, 3) int16 memmap; x, y, z are views into it
+RawArchive = namedtuple("RawArchive", ["node_id", "timestamp", "sample_rate", "range_g", "scale", "counts", "x", "y", "z"])
+
+
+# raw is a bytes-like buffer of 6 byte frames (ADXL345 data register order)
+def write_raw_archive(path, node_id, timestamp, sample_rate, range_flag, scale, raw):
+    raw = memoryview(raw)
+    if len(raw) % 6:
+        raise ValueError("raw buffer is not a whole number of 6 byte frames")
+
+    header = HEADER.pack(MAGIC, VERSION, range_flag, 0, float(scale), float(sample_rate), len(raw) // 6,
+                         str(node_id).encode("utf-8")[:16], str(timestamp).encode("utf-8")[:24])
+    with open(path, "wb") as f:
+        f.write(b"".join((header, raw)))
+
+
+def open_raw_archive(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+
+    magic, version, range_flag, _, scale, sample_rate, samples, node_id, timestamp = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("%s is not a raw vibration archive" % path)
+    if version != VERSION:
+        raise ValueError("Unsupported raw archive version %s in %s" % (version, path))
+
+    if samples:
+        counts = np.memmap(path, dtype='<i2', mode='r', offset=HEADER.size, shape=(samples, 3))
+    else:
+        counts = np.empty((0, 3), dtype='<i2')
+
+    return RawArchive(node_id.rstrip(b"\0").decode("utf-8"), timestamp.rstrip(b"\0").decode("utf-8"),
+                      sample_rate, RANGE_G.get(range_flag), scale, counts, counts[:, 0], counts[:, 1], counts[:, 2])
+
+
+# scaled (3, N) float32 copy of an archive in g, or m/s^2 with gforce=False
+def archive_to_axes(archive, gforce = True, earth_gravity = 9.80665):
+    scale = archive.scale if gforce else archive.scale * earth_gravity
+    out = np.empty((3, archive.counts.shape[0]), dtype=np.float32)
+    np.multiply(archive.counts.T, scale, out=out)
+    return out
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:]:
+        archive = open_raw_archive(name)
+        print("%s: node %s, %s, %s samples at %s Hz, +/-%sg" % (name, archive.node_id, archive.timestamp,
+              archive.counts.shape[0], archive.sample_rate, archive.range_g))
@@ -0,0 +1,107 @@
+import sys
+import zlib
+import struct
+import numpy as np
+from collections import namedtuple
+
+# Binary replacement for the fft_log CSV files.
+#
+# Layout (little endian):
+#   header   magic "HMSL", version (u8), flags (u8), sample rate (f64),
+#            samples per axis N (u32), spectrum bins (u32),
+#            node id length (u16), timestamp length (u16)
+#   strings  node id and timestamp, utf-8
+#   payload  float32 array of shape (6, bins): time domain x, y, z for the
+#            first `bins` samples followed by the FFT amplitudes x, y, z.
+#            zlib compressed when FLAG_ZLIB is set.
+# The time and frequency columns of the CSV are not stored, they follow from
+# the sample rate and N.
+
+MAGIC = b"HMSL"
+VERSION = 1
+FLAG_ZLIB = 0x01
+EXTENSION = ".hmsl"
+
+HEADER = struct.Struct("<4sBBdIIHH")
+
+CSV_HEADER = "Time,Amplitude_X,Amplitude_Y,Amplitude_Z,Frequency_X,Frequency_Y,Frequency_Z,FFT_Amplitude_X,FFT_Amplitude_Y,FFT_Amplitude_Z"
+
+# signal and magnitude are (3, bins) float32 arrays, time and frequencies (bins,)
+SpectralLog = namedtuple("SpectralLog", ["node_id", "timestamp", "sample_rate", "samples", "time", "frequencies", "signal", "magnitude"])
+
+
+def write_spectral_log(path, node_id, timestamp, sample_rate, samples, signal, magnitude, compress = True):
+    bins = magnitude.shape[1]
+    node = str(node_id).encode("utf-8")
+    stamp = str(timestamp).encode("utf-8")
+
+    payload = np.empty((6, bins), dtype='<f4')
+    payload[:3] = signal[:, :bins]
+    payload[3:] = magnitude
+    payload = payload.tobytes()
+
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, 6)
+        flags |= FLAG_ZLIB
+
+    header = HEADER.pack(MAGIC, VERSION, flags, float(sample_rate), samples, bins, len(node), len(stamp))
+    with open(path, "wb") as f:
+        f.write(b"".join((header, node, stamp, payload)))
+
+
+def read_spectral_log(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, flags, sample_rate, samples, bins, node_len, stamp_len = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("%s is not a spectral log" % path)
+    if version != VERSION:
+        raise ValueError("Unsupported spectral log version %s in %s" % (version, path))
+
+    pos = HEADER.size
+    node_id = data[pos:pos + node_len].decode("utf-8")
+    pos += node_len
+    timestamp = data[pos:pos + stamp_len].decode("utf-8")
+    pos += stamp_len
+
+    payload = data[pos:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+    columns = np.frombuffer(payload, dtype='<f4').reshape(6, bins)
+
+    time = np.arange(bins) / sample_rate
+    frequencies = np.arange(bins) * (sample_rate / samples)
+    return SpectralLog(node_id, timestamp, sample_rate, samples, time, frequencies, columns[:3], columns[3:])
+
+
+# writes the legacy fft_log CSV layout
+def write_legacy_csv(path, sample_rate, samples, signal, magnitude):
+    bins = magnitude.shape[1]
+    time = np.arange(bins) / sample_rate
+    frequencies = np.arange(bins) * (sample_rate / samples)
+
+    table = np.empty((bins, 10), dtype=np.float64)
+    table[:, 0] = time
+    table[:, 1:4] = signal[:, :bins].T
+    table[:, 4:7] = frequencies[:, None]
+    table[:, 7:10] = magnitude.T
+    np.savetxt(path, table, fmt="%.9g", delimiter=",", header=CSV_HEADER, comments="")
+
+
+# converts a spectral log to the legacy CSV, next to it unless csv_path is given
+def to_legacy_csv(path, csv_path = None):
+    log = read_spectral_log(path)
+    if csv_path is None:
+        csv_path = path[:-len(EXTENSION)] + ".csv" if path.endswith(EXTENSION) else path + ".csv"
+    write_legacy_csv(csv_path, log.sample_rate, log.samples, log.signal, log.magnitude)
+    return csv_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python3 spectral_log.py <file.hmsl> [...]")
+        sys.exit(1)
+    for name in sys.argv[1:]:
+        print("Converted %s to %s" % (name, to_legacy_csv(name)))
@@ -0,0 +1,154 @@
+import os
+import numpy as np
+
+from processing import WINDOWS
+
+
+# Welch PSD and rolling spectrogram over an unbounded stream of (3, n)
+# sample blocks. Memory use is fixed by the segment length and the number of
+# spectrogram rows kept, not by how long the recording runs.
+#
+# Every `emit_interval` seconds of signal the Welch average of that period and
+# the spectrogram rows added during it are written to output_dir, then the
+# period average starts over. The overall average since start keeps running.
+# Each frame holds only its own rows, so the frames of a recording
+# concatenated in order give its whole spectrogram.
+class StreamingSpectrum:
+
+    def __init__(self, sample_rate, segment = 1024, overlap = 0.5, window = "hann",
+                 history = 240, emit_interval = 60.0, output_dir = None, prefix = "vibration_stream"):
+        if window not in WINDOWS:
+            raise ValueError("Unrecognised window: \"%s\"" % window)
+        if not 0.0 <= overlap < 1.0:
+            raise ValueError("overlap must be in [0, 1)")
+
+        from scipy import fft
+        self._rfft = fft.rfft
+
+        self.sample_rate = float(sample_rate)
+        self.segment = segment
+        self.hop = max(1, int(segment * (1.0 - overlap)))
+        self.bins = segment // 2 + 1
+        self.history = history
+        self.emit_interval = emit_interval
+        self.output_dir = output_dir
+        self.prefix = prefix
+
+        self.frequencies = np.fft.rfftfreq(segment, 1.0 / self.sample_rate).astype(np.float32)
+        self.window = WINDOWS[window](segment).astype(np.float32)
+
+        # one sided power spectral density scaling, doubled everywhere but DC
+        # (and Nyquist for an even segment)
+        self._psd_scale = np.full(self.bins, 2.0 / (self.sample_rate * np.sum(self.window ** 2)), dtype=np.float32)
+        self._psd_scale[0] /= 2.0
+        if segment % 2 == 0:
+            self._psd_scale[-1] /= 2.0
+
+        # samples waiting to complete the next segment
+        self._pending = np.zeros((3, segment), dtype=np.float32)
+        self._pending_count = 0
+        self._windowed = np.empty((3, segment), dtype=np.float32)
+        self._power = np.empty((3, self.bins), dtype=np.float32)
+
+        # Welch accumulators: current emit period and since start
+        self._period_sum = np.zeros((3, self.bins), dtype=np.float64)
+        self._period_segments = 0
+        self._total_sum = np.zeros((3, self.bins), dtype=np.float64)
+        self._total_segments = 0
+
+        # spectrogram ring buffer, _next_row is where the next segment goes
+        self._spectrogram = np.zeros((history, 3, self.bins), dtype=np.float32)
+        self._row_times = np.zeros(history, dtype=np.float64)
+        self._next_row = 0
+        self._rows = 0
+        # rows added since the last emit, at most `history`
+        self._new_rows = 0
+
+        self.samples_seen = 0
+        self.frames_emitted = 0
+        self._next_emit = emit_interval
+
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    # feed a (3, n) block of samples, n can vary between calls
+    def feed(self, block):
+        n = block.shape[1]
+        start = 0
+        while start < n:
+            take = min(self.segment - self._pending_count, n - start)
+            self._pending[:, self._pending_count:self._pending_count + take] = block[:, start:start + take]
+            self._pending_count += take
+            start += take
+            self.samples_seen += take
+
+            if self._pending_count == self.segment:
+                self._process_segment()
+                # keep the overlapping tail for the next segment
+                keep = self.segment - self.hop
+                self._pending[:, :keep] = self._pending[:, self.hop:]
+                self._pending_count = keep
+
+            if self.emit_interval and self.elapsed() >= self._next_emit:
+                self.emit()
+                self._next_emit += self.emit_interval
+
+    # seconds of signal consumed so far
+    def elapsed(self):
+        return self.samples_seen / self.sample_rate
+
+    def _process_segment(self):
+        segment = self._pending
+        np.subtract(segment, segment.mean(axis=1, keepdims=True), out=self._windowed)
+        self._windowed *= self.window
+
+        spectrum = self._rfft(self._windowed, axis=1, overwrite_x=True)
+        np.abs(spectrum, out=self._power)
+        self._power **= 2
+        self._power *= self._psd_scale
+
+        self._period_sum += self._power
+        self._period_segments += 1
+        self._total_sum += self._power
+        self._total_segments += 1
+
+        self._spectrogram[self._next_row] = self._power
+        # time of the segment centre
+        self._row_times[self._next_row] = (self.samples_seen - self.segment / 2.0) / self.sample_rate
+        self._next_row = (self._next_row + 1) % self.history
+        self._rows = min(self._rows + 1, self.history)
+        self._new_rows = min(self._new_rows + 1, self.history)
+
+    # Welch PSD of the current emit period, (3, bins)
+    def period_psd(self):
+        return (self._period_sum / max(1, self._period_segments)).astype(np.float32)
+
+    # Welch PSD since the stream started, (3, bins)
+    def total_psd(self):
+        return (self._total_sum / max(1, self._total_segments)).astype(np.float32)
+
+    # spectrogram rows oldest first as (times, (rows, 3, bins)) copies, only
+    # the newest `last` rows if given
+    def spectrogram(self, last = None):
+        rows = self._rows if last is None else min(last, self._rows)
+        order = (np.arange(rows) + self._next_row - rows) % self.history
+        return self._row_times[order], self._spectrogram[order]
+
+    # write the current period to disk and start a new one
+    def emit(self):
+        if self.output_dir is not None and self._period_segments:
+            times, rows = self.spectrogram(self._new_rows)
+            path = os.path.join(self.output_dir, "%s_%05d.npz" % (self.prefix, self.frames_emitted))
+            np.savez(path,
+                     sample_rate=self.sample_rate,
+                     end_time=self.elapsed(),
+                     frequencies=self.frequencies,
+                     psd=self.period_psd(),
+                     segments=self._period_segments,
+                     spectrogram_times=times,
+                     spectrogram=rows)
+            print("Saved spectral frame %s" %path)
+        self.frames_emitted += 1
+        self._period_sum[:] = 0.0
+        self._period_segments = 0
+        self._new_rows = 0
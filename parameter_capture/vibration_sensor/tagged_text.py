@@ -0,0 +1,81 @@
+import os
+import sys
+import mmap
+import hashlib
+import numpy as np
+
+# atomic_file.py lives in parameter_capture/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from atomic_file import atomic_write
+
+# Loader for the legacy <L1>...</L1> tagged vibration text files.
+#
+# The file is memory mapped once, the tag spans are located with find() on
+# the raw bytes and each span is split on commas and converted to a float64
+# array in C. A value that is not a number, or channels of different
+# lengths, raise ValueError, so a corrupt file is never cached.
+#
+# Parsed channels are cached as .npz files named after the SHA-1 of the file
+# contents, so loading the same archive again skips the parse entirely.
+
+TAGS = ("L1", "L2", "L3")
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hivemonitor", "tagged_text")
+
+
+def _parse_span(data, tag):
+    begin_tag = ("<" + tag + ">").encode("ascii")
+    end_tag = ("</" + tag + ">").encode("ascii")
+
+    begin = data.find(begin_tag)
+    if begin < 0:
+        raise ValueError("Tag <%s> not found" % tag)
+    begin += len(begin_tag)
+    end = data.find(end_tag, begin)
+    if end < 0:
+        raise ValueError("Tag </%s> not found" % tag)
+
+    span = data[begin:end]
+    if not span.strip():
+        raise ValueError("Tag <%s> has no samples" % tag)
+    try:
+        return np.array(span.split(b","), dtype=np.float64)
+    except ValueError as e:
+        raise ValueError("Tag <%s>: %s" % (tag, e))
+
+
+# parses the tagged channels out of bytes-like data, returns a list of arrays
+def parse_tagged(data, tags = TAGS):
+    channels = [_parse_span(data, tag) for tag in tags]
+    lengths = [len(channel) for channel in channels]
+    if len(set(lengths)) > 1:
+        raise ValueError("Channel lengths differ: %s" % ", ".join("%s=%d" % item for item in zip(tags, lengths)))
+    return channels
+
+
+# returns the channels of a tagged text file as a list of float64 arrays,
+# one per tag. cache_dir=None disables the on-disk cache.
+def load_tagged_file(path, tags = TAGS, cache_dir = CACHE_DIR):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("%s is empty" % path)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        cache_path = None
+        if cache_dir is not None:
+            digest = hashlib.sha1(data).hexdigest()
+            cache_path = os.path.join(cache_dir, digest + "_" + "_".join(tags) + ".npz")
+            if os.path.exists(cache_path):
+                with np.load(cache_path) as cached:
+                    return [cached[tag] for tag in tags]
+
+        channels = parse_tagged(data, tags)
+    finally:
+        data.close()
+
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with atomic_write(cache_path, "wb") as f:
+            np.savez(f, **dict(zip(tags, channels)))
+
+    return channels
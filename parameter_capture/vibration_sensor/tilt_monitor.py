@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from collections import namedtuple
+
+import vibration
+from vibration import ADXL345
+
+# atomic_file.py lives in parameter_capture/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from atomic_file import atomic_write
+
+# Tilt/tamper detection. Every check averages a short burst of samples taken
+# at a low output data rate into a gravity vector and measures the angle
+# between it and the reference orientation kept in a small JSON state file.
+# A "moved" event is raised once the angle exceeds threshold_deg and a
+# "restored" event once it falls back below clear_deg, so a reading that
+# hovers around the threshold does not raise an event on every check.
+#
+#   python3 tilt_monitor.py                # check every 60s
+#   python3 tilt_monitor.py --once         # a single check
+#   python3 tilt_monitor.py --rebase       # accept the current orientation
+
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tilt_state.json")
+# written by the old coordinates.csv comparison (test1.py), seeds the
+# reference orientation when there is no state file yet
+LEGACY_COORDINATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "coordinates.csv")
+
+tilt_rate = vibration.BW_RATE_25HZ    # 50Hz ODR
+tilt_samples = 16
+
+# readings whose magnitude is this far from 1g are not at rest (the hive is
+# being handled) and do not tell the orientation
+rest_tolerance_g = 0.2
+
+# kind is "moved" or "restored", angle in degrees, gravity and reference in g
+TiltEvent = namedtuple("TiltEvent", ["kind", "angle", "gravity", "reference", "time"])
+
+
+# angle in degrees between two acceleration vectors
+def angle_between(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    cosine = np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    return float(np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))))
+
+
+# averaged (3,) gravity vector in g, read at tilt_rate
+def read_gravity(adxl345, samples = tilt_samples):
+    adxl345.setBandwidthRate(tilt_rate)
+    capture = adxl345.captureFifo(samples, True)
+    return capture.axes.mean(axis=1)
+
+
+def _read_legacy_reference(path):
+    try:
+        with open(path) as f:
+            rows = [line.split(",") for line in f if line.strip()]
+        # the last row is the most recent save, m/s^2 but only the direction
+        # matters
+        return [float(v) for v in rows[-1][:3]]
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class TiltMonitor:
+
+    def __init__(self, state_path = STATE_FILE, threshold_deg = 5.0, clear_deg = 2.0):
+        if clear_deg > threshold_deg:
+            raise ValueError("clear_deg must not exceed threshold_deg")
+        self.state_path = state_path
+        self.threshold_deg = threshold_deg
+        self.clear_deg = clear_deg
+        self._saved = True
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        state = {"reference": None, "moved": False, "angle": 0.0, "time": None}
+        if self.state_path == STATE_FILE:
+            state["reference"] = _read_legacy_reference(LEGACY_COORDINATES)
+        self._saved = False
+        return state
+
+    def _save(self):
+        with atomic_write(self.state_path) as f:
+            json.dump(self.state, f, indent=1)
+        self._saved = True
+
+    @property
+    def moved(self):
+        return self.state["moved"]
+
+    # makes gravity the reference orientation, e.g. after the hive was moved
+    # on purpose
+    def rebase(self, gravity):
+        self.state.update(reference=[float(v) for v in gravity], moved=False, angle=0.0, time=time.time())
+        self._save()
+
+    # Compares a gravity vector against the reference and returns a TiltEvent
+    # when the hysteresis thresholds are crossed, None otherwise. The state
+    # file is only written on the first reading and on events.
+    def check(self, gravity, now = None):
+        now = time.time() if now is None else now
+        if abs(np.linalg.norm(gravity) - 1.0) > rest_tolerance_g:
+            return None
+        if self.state["reference"] is None:
+            self.rebase(gravity)
+            return None
+        if not self._saved:
+            # reference seeded from coordinates.csv
+            self._save()
+
+        angle = angle_between(self.state["reference"], gravity)
+        if not self.state["moved"] and angle > self.threshold_deg:
+            kind = "moved"
+        elif self.state["moved"] and angle < self.clear_deg:
+            kind = "restored"
+        else:
+            return None
+
+        self.state.update(moved=(kind == "moved"), angle=angle, time=now, last=[float(v) for v in gravity])
+        self._save()
+        return TiltEvent(kind, angle, np.asarray(gravity), np.asarray(self.state["reference"]), now)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect a moved or tilted hive")
+    parser.add_argument("--interval", type=float, default=60.0, help="seconds between checks")
+    parser.add_argument("--threshold", type=float, default=5.0, help="degrees of tilt that count as moved")
+    parser.add_argument("--clear", type=float, default=2.0, help="degrees below which the hive is back in place")
+    parser.add_argument("--state", default=STATE_FILE, help="state file")
+    parser.add_argument("--once", action="store_true", help="check once and exit, status 1 if moved")
+    parser.add_argument("--rebase", action="store_true", help="make the current orientation the reference")
+    args = parser.parse_args()
+
+    adxl345 = ADXL345(rate_flag=tilt_rate)
+    monitor = TiltMonitor(args.state, args.threshold, args.clear)
+    if args.rebase:
+        monitor.rebase(read_gravity(adxl345))
+        print("Reference orientation updated")
+        sys.exit(0)
+
+    try:
+        while True:
+            event = monitor.check(read_gravity(adxl345))
+            if event is not None:
+                print("%s: hive %s, %.1f degrees from the reference"
+                      % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.time)), event.kind, event.angle))
+            if args.once:
+                sys.exit(1 if monitor.moved else 0)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
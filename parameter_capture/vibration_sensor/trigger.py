@@ -0,0 +1,283 @@
+import time
+import numpy as np
+from collections import namedtuple
+
+# Event-triggered vibration capture.
+#
+# An activity source watches the hive cheaply and TriggeredCapture escalates to
+# a full rate FIFO capture when it fires, keeping the samples that led up to
+# the trigger. Sources:
+#
+#   InterruptActivitySource  the ADXL345's own activity detection, waiting on
+#                            the INT1 line (or polling INT_SOURCE if no line is
+#                            wired). The FIFO runs in stream mode at the
+#                            capture rate and is the pre-trigger buffer, so
+#                            the pre-trigger is at most the FIFO's 32 samples
+#                            (20ms at 1600Hz).
+#   RmsActivitySource        samples at a low rate, tracks the AC RMS against
+#                            a running baseline and keeps a pre-trigger ring
+#                            buffer in memory.
+#   SimulatedActivitySource  replays a list of activity levels, for testing.
+#
+# Every source implements start(), stop(), wait(timeout) returning the
+# activity level that fired or None on timeout, pretrigger() returning
+# ((3, M) samples in g, their rate) and clock(), the seconds wait() counts its
+# timeout in. TriggeredCapture times its run and holdoff with the source's
+# clock, so a simulated source runs in simulated time.
+#
+# Only the ADXL345 instance passed in is used, not the vibration module:
+# vibration.py imports this module when run as a script, and importing it
+# back would load a second copy with its own bus.
+
+# vibration.BW_RATE_50HZ, the default rate of the RMS source
+BW_RATE_50HZ = 0x0A
+
+# pretrigger is a (3, M) array in g at pretrigger_rate, capture a FifoCapture
+TriggeredEvent = namedtuple("TriggeredEvent", ["time", "level", "pretrigger", "pretrigger_rate", "capture"])
+
+
+# fixed size (channels, capacity) ring buffer of the most recent samples
+class RingBuffer:
+
+    def __init__(self, capacity, channels = 3):
+        self.capacity = capacity
+        self.data = np.zeros((channels, capacity), dtype=np.float32)
+        self.head = 0
+        self.count = 0
+
+    # append a (channels, n) block, only the last `capacity` samples are kept
+    def write(self, block):
+        n = block.shape[1]
+        if n >= self.capacity:
+            self.data[:] = block[:, n - self.capacity:]
+            self.head = 0
+            self.count = self.capacity
+            return
+        first = min(n, self.capacity - self.head)
+        self.data[:, self.head:self.head + first] = block[:, :first]
+        self.data[:, :n - first] = block[:, first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+
+    # contents oldest first, as a copy
+    def read(self):
+        start = (self.head - self.count) % self.capacity
+        return np.roll(self.data, -start, axis=1)[:, :self.count].copy()
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+class InterruptActivitySource:
+
+    # pin: BCM pin INT1 is wired to, None to poll INT_SOURCE every
+    # poll_interval seconds instead. The host only sleeps until the
+    # interrupt, so nothing but the 32 entry FIFO holds the samples before
+    # it: use RmsActivitySource for a longer pre-trigger.
+    # rate_flag: BW_RATE flag to sample at, None keeps the sensor's current
+    # rate
+    def __init__(self, adxl345, threshold_g = 0.1, pin = None, rate_flag = None, poll_interval = 0.05):
+        self.adxl345 = adxl345
+        self.threshold_g = threshold_g
+        self.pin = pin
+        self.rate_flag = adxl345.getBandwidthRate() if rate_flag is None else rate_flag
+        self.poll_interval = poll_interval
+        self.rate = None
+        self._gpio = None
+
+    def start(self):
+        self.adxl345.setBandwidthRate(self.rate_flag)
+        self.rate = self.adxl345.getOutputDataRate()
+        # the FIFO keeps the last 32 samples at full rate for free
+        self.adxl345.enableFifoStream()
+        self.adxl345.enableActivityDetection(self.threshold_g)
+        if self.pin is not None and self._gpio is None:
+            import RPi.GPIO as GPIO
+            GPIO.setmode(GPIO.BCM)
+            GPIO.setup(self.pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            self._gpio = GPIO
+
+    def clock(self):
+        return time.monotonic()
+
+    def stop(self):
+        self.adxl345.disableActivityDetection()
+        self.adxl345.disableFifo()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.adxl345.activityDetected():
+                return self.threshold_g
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            if self._gpio is not None:
+                # sleeps in the kernel until INT1 rises
+                self._gpio.wait_for_edge(self.pin, self._gpio.RISING, timeout=max(1, int(remaining * 1000)))
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+
+    def pretrigger(self):
+        return self.adxl345.readFifoContents(True), self.rate
+
+
+class RmsActivitySource:
+
+    # fires when the AC RMS of a block on any axis exceeds both threshold_g
+    # and `factor` times the running baseline of quiet blocks
+    def __init__(self, adxl345, threshold_g = 0.02, factor = 4.0, rate_flag = BW_RATE_50HZ,
+                 block_size = 25, pretrigger_seconds = 2.0, baseline_alpha = 0.05):
+        self.adxl345 = adxl345
+        self.threshold_g = threshold_g
+        self.factor = factor
+        self.rate_flag = rate_flag
+        self.block_size = block_size
+        self.pretrigger_seconds = pretrigger_seconds
+        self.baseline_alpha = baseline_alpha
+        self.baseline = None
+        self.rate = None
+        self.ring = None
+        self._stream = None
+
+    def start(self):
+        self.adxl345.setBandwidthRate(self.rate_flag)
+        self.rate = self.adxl345.getOutputDataRate()
+        if self.ring is None:
+            self.ring = RingBuffer(max(1, int(self.pretrigger_seconds * self.rate)))
+        self.ring.clear()
+        self._stream = self.adxl345.streamFifo(self.block_size, None, True)
+
+    def stop(self):
+        if self._stream is not None:
+            # closing the generator takes the FIFO out of stream mode
+            self._stream.close()
+            self._stream = None
+
+    def clock(self):
+        return time.monotonic()
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            block = next(self._stream)
+            self.ring.write(block)
+            rms = float(block.std(axis=1).max())
+            if self.baseline is None:
+                self.baseline = rms
+            if rms > self.threshold_g and rms > self.factor * self.baseline:
+                return rms
+            self.baseline += self.baseline_alpha * (rms - self.baseline)
+        return None
+
+    def pretrigger(self):
+        return self.ring.read(), self.rate
+
+
+class SimulatedActivitySource:
+
+    # levels: activity level returned by each successive wait(), None for a
+    # quiet wait. The source is exhausted (always quiet) once they run out.
+    # Nothing sleeps: a quiet wait moves the simulated clock on by its
+    # timeout and one that fires by `interval` (at most the timeout), so runs
+    # and holdoffs take no wall time and always come out the same.
+    def __init__(self, levels, pretrigger_samples = 64, rate = 100.0, seed = 0, interval = 0.1):
+        self.levels = iter(levels)
+        self.pretrigger_samples = pretrigger_samples
+        self.rate = rate
+        self.rng = np.random.default_rng(seed)
+        self.interval = interval
+        self.waits = 0
+        self.now = 0.0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def clock(self):
+        return self.now
+
+    def wait(self, timeout):
+        self.waits += 1
+        level = next(self.levels, None)
+        self.now += timeout if level is None else min(self.interval, timeout)
+        return level
+
+    def pretrigger(self):
+        samples = self.rng.normal(0.0, 0.01, size=(3, self.pretrigger_samples)).astype(np.float32)
+        samples[2] += 1.0
+        return samples, self.rate
+
+
+class TriggeredCapture:
+
+    # capture_samples: samples per axis of the full rate capture
+    # capture_rate:    BW_RATE flag of the full rate capture, None for the
+    #                  rate the sensor is set to now
+    # holdoff:         seconds after a capture before the next trigger counts
+    def __init__(self, adxl345, source, capture_samples = 4000, capture_rate = None, holdoff = 5.0):
+        self.adxl345 = adxl345
+        self.source = source
+        self.capture_samples = capture_samples
+        self.capture_rate = adxl345.getBandwidthRate() if capture_rate is None else capture_rate
+        self.holdoff = holdoff
+        # triggers ignored because they came during a holdoff
+        self.suppressed = 0
+
+    # Keeps waiting on the source for `holdoff` seconds and drops whatever
+    # fires, rather than sleeping: activity latched by the source (the
+    # ADXL345's INT_SOURCE) is cleared and the RMS source keeps its ring and
+    # baseline current, so the first trigger after the holdoff is new
+    # activity and not what happened during it.
+    def _hold_off(self, end = None):
+        clock = self.source.clock
+        holdoff_end = clock() + self.holdoff
+        if end is not None:
+            holdoff_end = min(holdoff_end, end)
+        while True:
+            remaining = holdoff_end - clock()
+            if remaining <= 0:
+                return
+            if self.source.wait(remaining) is not None:
+                self.suppressed += 1
+
+    # takes the full rate capture for a trigger at `level`
+    def capture(self, level):
+        triggered_at = time.time()
+        pretrigger, pretrigger_rate = self.source.pretrigger()
+        self.source.stop()
+        try:
+            self.adxl345.setBandwidthRate(self.capture_rate)
+            capture = self.adxl345.captureFifo(self.capture_samples, True)
+        finally:
+            self.source.start()
+        return TriggeredEvent(triggered_at, level, pretrigger, pretrigger_rate, capture)
+
+    # Watches for activity for `duration` seconds (forever if None) or until
+    # max_events captures, calling on_event(event) for each. Returns the number
+    # of events captured.
+    def run(self, duration = None, max_events = None, on_event = None, poll_timeout = 1.0):
+        clock = self.source.clock
+        end = None if duration is None else clock() + duration
+        events = 0
+        self.source.start()
+        try:
+            while max_events is None or events < max_events:
+                timeout = poll_timeout if end is None else min(poll_timeout, end - clock())
+                if timeout <= 0:
+                    break
+                level = self.source.wait(timeout)
+                if level is None:
+                    continue
+                event = self.capture(level)
+                events += 1
+                if on_event is not None:
+                    on_event(event)
+                if self.holdoff:
+                    self._hold_off(end)
+        finally:
+            self.source.stop()
+        return events
@@ -1,17 +1,45 @@
+import os
+import json
+import time
 import datetime
-import smbus
-from scipy import fftpack
 import numpy as np
 import sys
+from collections import namedtuple
+
+from processing import VibrationProcessor, Decimator, timing_stats, resample_uniform
+import spectral_log
+import raw_archive
+from raw_archive import write_raw_archive
+from spectral_log import write_spectral_log, write_legacy_csv
 
 sys.path.append('/home/pi/Desktop/HiveMonitor2/')
+# the checkout this file lives in, for running off the Pi
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
 from multimedia_capture.config import node_id
 from multimedia_capture.config import timeString
 
-# select the correct i2c bus for this revision of Raspberry Pi
-revision = ([l[12:-1] for l in open('/proc/cpuinfo','r').readlines() if l[:8]=="Revision"]+['0000'])[0]
-bus = smbus.SMBus(1 if int(revision, 16) >= 4 else 0)
+# The I2C bus is opened on first use by get_bus(), not at import, so
+# importing this module stays cheap and works without the hardware.
+#
+# EMULATE_ADXL345 (environment variable of the same name) selects the emulated
+# bus from emulated_adxl345.py instead: "1" runs it unthrottled, "realtime"
+# paces it like the real sensor.
+EMULATE_ADXL345 = os.environ.get("EMULATE_ADXL345", "")
+
+_bus = None
+
+def get_bus():
+    global _bus
+    if _bus is None and EMULATE_ADXL345:
+        from emulated_adxl345 import EmulatedSMBus
+        _bus = EmulatedSMBus(realtime=(EMULATE_ADXL345 == "realtime"))
+    elif _bus is None:
+        import smbus
+        # select the correct i2c bus for this revision of Raspberry Pi
+        revision = ([l[12:-1] for l in open('/proc/cpuinfo','r').readlines() if l[:8]=="Revision"]+['0000'])[0]
+        _bus = smbus.SMBus(1 if int(revision, 16) >= 4 else 0)
+    return _bus
 
 # ADXL345 constants
 EARTH_GRAVITY_MS2   = 9.80665
@@ -37,30 +65,155 @@ RANGE_16G           = 0x03
 MEASURE             = 0x08
 AXES_DATA           = 0x32
 
+# activity detection and interrupts
+THRESH_ACT          = 0x24 # 62.5mg per LSB
+ACT_INACT_CTL       = 0x27
+INT_ENABLE          = 0x2E
+INT_MAP             = 0x2F
+INT_SOURCE          = 0x30
+
+ACT_AC_COUPLED      = 0x80
+ACT_X_ENABLE        = 0x40
+ACT_Y_ENABLE        = 0x20
+ACT_Z_ENABLE        = 0x10
+
+INT_DATA_READY      = 0x80
+INT_ACTIVITY        = 0x10
+INT_WATERMARK       = 0x02
+INT_OVERRUN         = 0x01
+
+THRESH_ACT_SCALE    = 0.0625
+
+# FIFO registers. The BW_RATE_* names above give the bandwidth; the output
+# data rate the FIFO is filled at is twice that (datasheet table 7).
+FIFO_CTL            = 0x38
+FIFO_STATUS         = 0x39
+
+FIFO_MODE_BYPASS    = 0x00
+FIFO_MODE_FIFO      = 0x40
+FIFO_MODE_STREAM    = 0x80
+FIFO_MODE_TRIGGER   = 0xC0
+
+FIFO_SIZE           = 32
+FIFO_WATERMARK      = 16
+
+OUTPUT_DATA_RATE_HZ = {
+    0x0F: 3200.0,
+    0x0E: 1600.0,
+    0x0D: 800.0,
+    0x0C: 400.0,
+    0x0B: 200.0,
+    0x0A: 100.0,
+    0x09: 50.0,
+    0x08: 25.0,
+    0x07: 12.5,
+    0x06: 6.25,
+}
+
 #other constants
 samples_to_read = 10000
 sample_rate = 1030
 
-channel_1 = []
-channel_2 = []
-channel_3 = []
+# "fifo" drains the ADXL345 FIFO at a fixed output data rate, "poll" is the
+# original one-sample-per-read loop. Each FIFO sample is a 6 byte I2C read, so
+# with the default 100kHz bus clock 800Hz ODR (BW_RATE_400HZ) is the fastest
+# rate that can be drained without the FIFO overrunning.
+acquisition_mode = "fifo"
+fifo_rate = BW_RATE_400HZ
+
+# Capture profiles: output data rate and range the sensor runs at, the number
+# of samples per axis read from it and the decimation applied before the FFT.
+# Decimating an oversampled capture keeps the band below ~0.4 * rate /
+# decimate and shrinks the FFT and the spectral log by the same factor.
+# Full resolution mode is 4mg/LSB in every range, so a narrower range only
+# clips sooner.
+#   full  the whole 0-400Hz band at 800Hz ODR
+#   hive  0-160Hz (colony hum, fanning, piping fundamentals) decimated to 400Hz
+#   low   0-80Hz decimated to 200Hz, a twice as long capture for 0.04Hz bins
+CAPTURE_PROFILES = {
+    "full": {"rate": fifo_rate, "range": RANGE_16G, "samples": samples_to_read, "decimate": 1},
+    "hive": {"rate": BW_RATE_400HZ, "range": RANGE_16G, "samples": samples_to_read, "decimate": 2},
+    "low": {"rate": BW_RATE_400HZ, "range": RANGE_16G, "samples": 2 * samples_to_read, "decimate": 4},
+}
+capture_profile = "full"
+
+# "poll" mode paces reads to poll_rate with perf_counter_ns. If the 99th
+# percentile timing jitter exceeds jitter_threshold (fraction of a sample
+# period) the capture is resampled onto a uniform grid before the FFT.
+poll_rate = 1000.0
+jitter_threshold = 0.1
+
+# captures are written below data_dir, VIBRATION_DATA_DIR overrides it
+data_dir = os.environ.get("VIBRATION_DATA_DIR", "/home/pi/Desktop/HiveMonitor2/parameter_capture/vibration_sensor/")
+if not data_dir.endswith("/"):
+    data_dir += "/"
+
+# fft_log output: "binary" writes the compact spectral log (see spectral_log.py,
+# which also converts it back to CSV), "csv" the legacy text file
+fft_log_format = "binary"
+fft_log_dir = data_dir + "fft_log/"
+
+# keep the raw sensor counts of every FIFO capture (see raw_archive.py)
+save_raw_archive = True
+raw_archive_dir = data_dir + "raw_archive/"
+
+# streaming mode: samples per FIFO block, Welch segment length and how often
+# (seconds) a spectral frame is written to stream_log
+stream_block_size = 256
+stream_segment = 1024
+stream_emit_interval = 60.0
+stream_log_dir = data_dir + "stream_log/"
+
+# triggered mode: watch for activity cheaply and take a full rate capture of
+# trigger_samples when it is seen. activity_int_pin is the BCM pin the
+# ADXL345's INT1 is wired to, the sensor then triggers on trigger_threshold_g.
+# With None it is watched at a low rate in software and triggers on an AC RMS
+# above trigger_rms_g (see trigger.py). Events are written to trigger_log_dir.
+activity_int_pin = None
+trigger_threshold_g = 0.1
+trigger_rms_g = 0.02
+trigger_samples = 4000
+trigger_holdoff = 5.0
+trigger_log_dir = data_dir + "trigger_log/"
+
+# result of ADXL345.captureFifo(): axes is a (3, N) array, sample_rate the
+# output data rate every sample was taken at, overruns the number of times
+# the FIFO was found full (samples may have been lost) and raw the undecoded
+# 6 byte frames as read from the sensor
+FifoCapture = namedtuple("FifoCapture", ["axes", "sample_rate", "overruns", "raw"])
+
+# result of ADXL345.capturePaced(): axes is a (3, N) array, timestamps the
+# perf_counter_ns() time of every sample and raw the undecoded frames
+PacedCapture = namedtuple("PacedCapture", ["axes", "timestamps", "raw"])
 
 #####functions#####
+# Bulk decode of little endian 6 byte x/y/z frames: the AXES_DATA register
+# layout, which is also what the FIFO returns and raw archives store. raw may
+# hold any number of frames; they are decoded in one vectorised pass into a
+# (3, N) array scaled to g (gforce) or m/s^2, written into out when given.
+def decode_frames(raw, gforce = False, out = None, dtype = np.float32):
+    counts = np.frombuffer(raw, dtype='<i2').reshape(-1, 3)
+    if out is None:
+        out = np.empty((3, counts.shape[0]), dtype=dtype)
+    scale = SCALE_MULTIPLIER if gforce else SCALE_MULTIPLIER * EARTH_GRAVITY_MS2
+    np.multiply(counts.T, scale, out=out)
+    return out
+
+# same as decode_frames() but returns the (g, m/s^2) pair
+def decode_frames_both(raw, dtype = np.float32):
+    g = decode_frames(raw, True, dtype=dtype)
+    return g, g * dtype(EARTH_GRAVITY_MS2)
+
 def conv_str_tag(channel, tag):
     # Convert every channel from int to str, separated by a coma and adds tags at the beginning and end.
-    n = len(channel)
-    s_channel = '<' + tag + '>'
-    for i in range(n-1):
-        s_channel = s_channel + str(channel[i]) + ','
-    s_channel = s_channel + str(channel[n-1]) + '</'+ tag + '>'
-    return s_channel
+    return '<' + tag + '>' + ','.join(map(str, channel)) + '</'+ tag + '>'
 
 #####Add tags and save on file#####
+# Legacy text format, new captures are archived with raw_archive instead.
 def record(channel_1, channel_2, channel_3, archive):
-    str_channel = ''
-    str_channel += conv_str_tag(channel_1, 'L1') + '\n'
-    str_channel += conv_str_tag(channel_2, 'L2') + '\n'
-    str_channel += conv_str_tag(channel_3, 'L3') + '\n'
+    str_channel = '\n'.join((conv_str_tag(channel_1, 'L1'),
+                              conv_str_tag(channel_2, 'L2'),
+                              conv_str_tag(channel_3, 'L3'))) + '\n'
 
     # Write to file
     arch = open("/home/pi/Desktop/HiveMonitor2/parameter_capture/vibration_sensor/text_file/"+archive, "w")
@@ -70,28 +223,40 @@ def record(channel_1, channel_2, channel_3, archive):
 class ADXL345:
 
     address = None
+    range_flag = RANGE_16G
 
-    def __init__(self, address = 0x53):        
+    def __init__(self, address = 0x53, rate_flag = BW_RATE_1600HZ, range_flag = RANGE_16G):
         self.address = address
-        self.setBandwidthRate(BW_RATE_1600HZ)
-        self.setRange(RANGE_16G)
+        self.bus = get_bus()
+        self.setBandwidthRate(rate_flag)
+        self.setRange(range_flag)
         self.enableMeasurement()
 
+    # sets the output data rate and range of a CAPTURE_PROFILES entry
+    def applyProfile(self, profile):
+        self.setBandwidthRate(profile["rate"])
+        self.setRange(profile["range"])
+
     def enableMeasurement(self):
-        bus.write_byte_data(self.address, POWER_CTL, MEASURE)
+        self.bus.write_byte_data(self.address, POWER_CTL, MEASURE)
 
     def setBandwidthRate(self, rate_flag):
-        bus.write_byte_data(self.address, BW_RATE, rate_flag)
+        self.bus.write_byte_data(self.address, BW_RATE, rate_flag)
+
+    # the BW_RATE flag the sensor is currently set to
+    def getBandwidthRate(self):
+        return self.bus.read_byte_data(self.address, BW_RATE) & 0x0F
 
     # set the measurement range for 10-bit readings
     def setRange(self, range_flag):
-        value = bus.read_byte_data(self.address, DATA_FORMAT)
+        value = self.bus.read_byte_data(self.address, DATA_FORMAT)
 
         value &= ~0x0F;
         value |= range_flag;  
         value |= 0x08;
 
-        bus.write_byte_data(self.address, DATA_FORMAT, value)
+        self.bus.write_byte_data(self.address, DATA_FORMAT, value)
+        self.range_flag = range_flag
     
     # returns the current reading from the sensor for each axis
     #
@@ -99,126 +264,339 @@ class ADXL345:
     #    False (default): result is returned in m/s^2
     #    True           : result is returned in gs
     def getAxes(self, gforce = False):
-        bytes = bus.read_i2c_block_data(self.address, AXES_DATA, 6)
-        
-        x = bytes[0] | (bytes[1] << 8)
-        if(x & (1 << 16 - 1)):
-            x = x - (1<<16)
+        frame = bytes(self.bus.read_i2c_block_data(self.address, AXES_DATA, 6))
+        x, y, z = decode_frames(frame, gforce, dtype=np.float64)[:, 0].tolist()
+        return {"x": round(x, 4), "y": round(y, 4), "z": round(z, 4)}
+
+    # reads `samples` frames back to back from the data registers and decodes
+    # them in one pass, returns a (3, samples) array
+    def readAxes(self, samples, gforce = False, out = None):
+        raw = bytearray(samples * 6)
+        address = self.address
+        read_block = self.bus.read_i2c_block_data
+        for pos in range(0, len(raw), 6):
+            raw[pos:pos + 6] = bytes(read_block(address, AXES_DATA, 6))
+        return decode_frames(raw, gforce, out)
+
+    # returns the output data rate in Hz the sensor is currently sampling at
+    def getOutputDataRate(self):
+        rate_flag = self.bus.read_byte_data(self.address, BW_RATE) & 0x0F
+        return OUTPUT_DATA_RATE_HZ[rate_flag]
+
+    # raise the activity interrupt (INT1 pin and INT_SOURCE) when any enabled
+    # axis moves more than threshold_g. AC coupled compares against the
+    # acceleration at the moment detection is enabled, so gravity and the
+    # hive's tilt do not count as activity.
+    def enableActivityDetection(self, threshold_g, axes = ACT_X_ENABLE | ACT_Y_ENABLE | ACT_Z_ENABLE, ac_coupled = True):
+        threshold = max(1, min(255, int(round(threshold_g / THRESH_ACT_SCALE))))
+        self.bus.write_byte_data(self.address, THRESH_ACT, threshold)
+        self.bus.write_byte_data(self.address, ACT_INACT_CTL, axes | (ACT_AC_COUPLED if ac_coupled else 0))
+        # route activity to INT1
+        self.bus.write_byte_data(self.address, INT_MAP, 0x00)
+        self.bus.write_byte_data(self.address, INT_ENABLE, INT_ACTIVITY)
+        # reading INT_SOURCE clears anything latched before now
+        self.getInterruptSource()
+
+    def disableActivityDetection(self):
+        self.bus.write_byte_data(self.address, INT_ENABLE, 0x00)
+
+    # reads (and so clears) the latched interrupt flags
+    def getInterruptSource(self):
+        return self.bus.read_byte_data(self.address, INT_SOURCE)
+
+    # True if activity was latched since the last check, which clears it
+    def activityDetected(self):
+        return bool(self.getInterruptSource() & INT_ACTIVITY)
+
+    # put the FIFO in stream mode; the watermark is the number of queued
+    # samples at which we start draining it
+    def enableFifoStream(self, watermark = FIFO_WATERMARK):
+        # going through bypass mode clears anything left in the FIFO
+        self.bus.write_byte_data(self.address, FIFO_CTL, FIFO_MODE_BYPASS)
+        self.bus.write_byte_data(self.address, FIFO_CTL, FIFO_MODE_STREAM | (watermark & 0x1F))
+
+    def disableFifo(self):
+        self.bus.write_byte_data(self.address, FIFO_CTL, FIFO_MODE_BYPASS)
+
+    # number of samples currently queued in the FIFO
+    def getFifoEntries(self):
+        return self.bus.read_byte_data(self.address, FIFO_STATUS) & 0x3F
+
+    # drains whatever is queued in a FIFO in stream mode, returns a (3, N)
+    # array
+    def readFifoContents(self, gforce = False):
+        raw = bytearray(self.getFifoEntries() * 6)
+        self.readFifo(raw, self.getOutputDataRate())
+        return decode_frames(raw, gforce)
+
+    # drains len(raw) // 6 samples from a FIFO that is already in stream mode
+    # into the bytearray raw and returns how many times the FIFO was found
+    # full (samples may have been lost)
+    def readFifo(self, raw, rate, watermark = FIFO_WATERMARK):
+        end = len(raw)
+        pos = 0
+        overruns = 0
+
+        # look the bus methods up once, they are called for every sample
+        address = self.address
+        read_byte = self.bus.read_byte_data
+        read_block = self.bus.read_i2c_block_data
+
+        while pos < end:
+            entries = read_byte(address, FIFO_STATUS) & 0x3F
+            if entries < watermark and end - pos > entries * 6:
+                # sleep until roughly the watermark is reached instead of
+                # spinning on the status register
+                time.sleep((watermark - entries) / rate)
+                continue
+
+            # a full FIFO in stream mode means older samples were dropped
+            if entries >= FIFO_SIZE:
+                overruns += 1
+
+            for _ in range(min(entries, (end - pos) // 6)):
+                # the six data registers must be read in one transaction,
+                # which also pops the entry off the FIFO
+                raw[pos:pos + 6] = bytes(read_block(address, AXES_DATA, 6))
+                pos += 6
+
+        return overruns
+
+    # collects `samples` readings through the FIFO and returns them as a
+    # (3, samples) float32 array along with the output data rate they were
+    # taken at. Raw frames are gathered into one buffer and decoded in a
+    # single pass instead of per sample.
+    #
+    # parameter gforce:
+    #    False (default): result is returned in m/s^2
+    #    True           : result is returned in gs
+    def captureFifo(self, samples, gforce = False, watermark = FIFO_WATERMARK, out = None):
+        if out is None:
+            out = np.empty((3, samples), dtype=np.float32)
+
+        rate = self.getOutputDataRate()
+        raw = bytearray(samples * 6)
+
+        self.enableFifoStream(watermark)
+        try:
+            overruns = self.readFifo(raw, rate, watermark)
+        finally:
+            self.disableFifo()
+
+        decode_frames(raw, gforce, out)
+        return FifoCapture(out, rate, overruns, raw)
+
+    # polls the data registers `samples` times, paced to `rate` Hz with
+    # perf_counter_ns(), and records when each sample was taken. If a read
+    # runs late the schedule restarts from now instead of bursting to catch
+    # up, which would bunch samples together.
+    def capturePaced(self, samples, rate, gforce = False, out = None):
+        if out is None:
+            out = np.empty((3, samples), dtype=np.float32)
+
+        raw = bytearray(samples * 6)
+        timestamps = np.empty(samples, dtype=np.int64)
+        period = int(1e9 / rate)
+
+        address = self.address
+        read_block = self.bus.read_i2c_block_data
+        clock = time.perf_counter_ns
+        sleep = time.sleep
+
+        next_sample = clock()
+        for i in range(samples):
+            now = clock()
+            # sleep through most of the wait, spin the last 200us for accuracy
+            if next_sample - now > 200000:
+                sleep((next_sample - now - 200000) / 1e9)
+            while now < next_sample:
+                now = clock()
+
+            block = read_block(address, AXES_DATA, 6)
+            # timestamp the middle of the transfer
+            timestamps[i] = (now + clock()) // 2
+            raw[i * 6:i * 6 + 6] = bytes(block)
+
+            next_sample += period
+            if now - next_sample > period:
+                next_sample = now + period
+
+        decode_frames(raw, gforce, out)
+        return PacedCapture(out, timestamps, raw)
+
+    # reads the FIFO continuously and yields (3, block_size) arrays until
+    # `blocks` have been produced (forever if None). The same raw and output
+    # buffers are reused for every block, so consume each one before asking
+    # for the next.
+    def streamFifo(self, block_size, blocks = None, gforce = False, watermark = FIFO_WATERMARK):
+        rate = self.getOutputDataRate()
+        raw = bytearray(block_size * 6)
+        out = np.empty((3, block_size), dtype=np.float32)
+
+        self.enableFifoStream(watermark)
+        try:
+            produced = 0
+            while blocks is None or produced < blocks:
+                overruns = self.readFifo(raw, rate, watermark)
+                if overruns:
+                    print("FIFO overran %s times, samples were lost" %overruns)
+                decode_frames(raw, gforce, out)
+                yield out
+                produced += 1
+        finally:
+            self.disableFifo()
 
-        y = bytes[2] | (bytes[3] << 8)
-        if(y & (1 << 16 - 1)):
-            y = y - (1<<16)
 
-        z = bytes[4] | (bytes[5] << 8)
-        if(z & (1 << 16 - 1)):
-            z = z - (1<<16)
+def mainprog():
+    profile = CAPTURE_PROFILES[capture_profile]
+    decimator = Decimator(profile["decimate"])
+    to_read = profile["samples"]
+    samples_to_keep = decimator.output_length(to_read)
+
+    # poll mode reads the data registers at poll_rate, so keep the sensor
+    # itself running well above that
+    rate_flag = profile["rate"] if acquisition_mode == "fifo" else BW_RATE_1600HZ
+    adxl345 = ADXL345(rate_flag=rate_flag, range_flag=profile["range"])
+    processor = VibrationProcessor(samples_to_keep, sample_rate)
+    samples = processor.buffer
+    print("START")
+    print("Collecting sensor readings, profile %s" %capture_profile)
+    rate = sample_rate
+    if acquisition_mode == "fifo":
+        # without decimation the capture goes straight into the FFT buffer
+        capture = adxl345.captureFifo(to_read, True, out=samples if decimator.factor == 1 else None)    #False = m/s^2, True = g
+        rate = capture.sample_rate
+        print("Output data rate: %s Hz" %rate)
+        if capture.overruns:
+            print("FIFO overran %s times, samples were lost" %capture.overruns)
+        if save_raw_archive:
+            os.makedirs(raw_archive_dir, exist_ok=True)
+            raw_name = "vibration_"+str(node_id)+ "_" + str(timeString)+raw_archive.EXTENSION
+            # full resolution mode keeps SCALE_MULTIPLIER g per count in every range
+            write_raw_archive(raw_archive_dir+raw_name, node_id, timeString, rate,
+                              adxl345.range_flag, SCALE_MULTIPLIER, capture.raw)
+            print("Raw counts archived to %s" %raw_name)
+        timing = {"mode": "fifo", "achieved_rate_hz": rate, "fifo_overruns": capture.overruns}
+        uniform = capture.axes
+    else:
+        capture = adxl345.capturePaced(to_read, poll_rate, True)    #False = m/s^2, True = g
+        timing = timing_stats(capture.timestamps, poll_rate)
+        timing["mode"] = "poll"
+        rate = timing["achieved_rate_hz"]
+        print("Achieved rate: %.1f Hz (target %s Hz), p99 jitter %.1f us"
+              %(rate, poll_rate, timing["jitter_p99_us"]))
+
+        # the FFT assumes evenly spaced samples
+        timing["resampled"] = timing["jitter_p99_us"] > jitter_threshold * 1e6 / rate
+        if timing["resampled"]:
+            print("Jitter above threshold, resampling onto a uniform grid")
+            uniform = resample_uniform(capture.axes, capture.timestamps, rate)
+        else:
+            uniform = capture.axes
+
+    if decimator.factor > 1:
+        decimator.process(uniform, out=samples)
+        rate = decimator.output_rate(rate)
+        timing["decimate"] = decimator.factor
+        print("Decimated by %s to %s Hz" %(decimator.factor, rate))
+    elif uniform is not samples:
+        samples[:] = uniform
+
+    print("Amount of samples per channel: %s" %samples.shape[1])
+
+    #####Remove DC offset and calculate the fft#####
+    result = processor.process(sample_rate=rate)
+
+    print("Vdc Channel 1: ",result.dc_offset[0])
+    print("Vdc Channel 2: ",result.dc_offset[1])
+    print("Vdc Channel 3: ",result.dc_offset[2])
+
+    #####saving to fft_log#####
+    os.makedirs(fft_log_dir, exist_ok=True)
+    if fft_log_format == "csv":
+        archive = "vibration_"+str(node_id)+ "_" + str(timeString)+".csv"
+        print("Saving to %s" %archive)
+        write_legacy_csv(fft_log_dir+archive, rate, samples_to_keep, result.signal, result.magnitude)
+    else:
+        archive = "vibration_"+str(node_id)+ "_" + str(timeString)+spectral_log.EXTENSION
+        print("Saving to %s" %archive)
+        write_spectral_log(fft_log_dir+archive, node_id, timeString, rate, samples_to_keep, result.signal, result.magnitude)
+    fname = archive
 
-        x = x * SCALE_MULTIPLIER 
-        y = y * SCALE_MULTIPLIER
-        z = z * SCALE_MULTIPLIER
+    # timing statistics next to the capture
+    with open(fft_log_dir+os.path.splitext(archive)[0]+".timing.json", "w") as f:
+        json.dump(timing, f, indent=1)
+    print("Saving complete")
+    print("END")
+    return(fname)
+   
 
-        if gforce == False:
-            x = x * EARTH_GRAVITY_MS2
-            y = y * EARTH_GRAVITY_MS2
-            z = z * EARTH_GRAVITY_MS2
+# Continuous monitoring: keeps a running Welch PSD and rolling spectrogram and
+# writes a spectral frame every stream_emit_interval seconds. Runs for
+# `duration` seconds, or until interrupted if None.
+def streamprog(duration = None):
+    from streaming import StreamingSpectrum
 
-        x = round(x, 4)
-        y = round(y, 4)
-        z = round(z, 4)
+    adxl345 = ADXL345()
+    adxl345.setBandwidthRate(fifo_rate)
+    rate = adxl345.getOutputDataRate()
+    prefix = "vibration_stream_"+str(node_id)+ "_" + str(timeString)
+    spectrum = StreamingSpectrum(rate, segment=stream_segment, emit_interval=stream_emit_interval,
+                                 output_dir=stream_log_dir, prefix=prefix)
+    blocks = None if duration is None else int(duration * rate / stream_block_size) + 1
+    print("START streaming at %s Hz" %rate)
+    try:
+        for block in adxl345.streamFifo(stream_block_size, blocks, True):
+            spectrum.feed(block)
+    except KeyboardInterrupt:
+        pass
+    # flush the last partial period
+    spectrum.emit()
+    print("END")
+    return spectrum
 
-        return {"x": x, "y": y, "z": z}
 
+# Event-triggered capture: sleeps until activity is detected and stores the
+# pre-trigger samples, raw counts and spectrum of every event. Runs for
+# `duration` seconds, or until interrupted if None.
+def triggerprog(duration = None):
+    from trigger import TriggeredCapture, InterruptActivitySource, RmsActivitySource
 
-def mainprog():
     adxl345 = ADXL345()
-    print("START")
-    print("Collecting sensor readings")
-    sample_counter = 0;
-    while(sample_counter < samples_to_read):
-        axes = adxl345.getAxes(True)    #False = m/s^2, True = g
-        #put the axes into variables
-        x = axes['x']
-        y = axes['y']
-        z = axes['z']
-    	
-        channel_1.append(x)
-        channel_2.append(y)
-        channel_3.append(z)
-    	
-        sample_counter = sample_counter + 1;
-    
-    print("Amount of samples in channel 1: %s" %len(channel_1))
-    print("Amount of samples in channel 2: %s" %len(channel_2))
-    print("Amount of samples in channel 3: %s" %len(channel_3))
-    
-    #####Calculate average value for each channel#####
-    num_data = len(channel_1)
-    X = range(0, num_data, 1)
-    vdc_channel_1 = 0
-    vdc_channel_2 = 0
-    vdc_channel_3 = 0
-    for indice in X:
-        vdc_channel_1 += channel_1[indice]
-        vdc_channel_2 += channel_2[indice]
-        vdc_channel_3 += channel_3[indice]
-    vdc_channel_1 = vdc_channel_1 / num_data
-    vdc_channel_2 = vdc_channel_2 / num_data
-    vdc_channel_3 = vdc_channel_3 / num_data
-    
-    print("Vdc Channel 1: ",vdc_channel_1)
-    print("Vdc Channel 2: ",vdc_channel_2)
-    print("Vdc Channel 3: ",vdc_channel_3)
-    
-    #####Subtract DC offset#####
-    '''
-    This operation is used to remove the DC offset from each channel, 
-    resulting in a signal with its average value centered around zero.
-    '''
-    for indice in X:
-        channel_1[indice] -= vdc_channel_1
-        channel_2[indice] -= vdc_channel_2
-        channel_3[indice] -= vdc_channel_3
-    
-    
-    #####calculation of fft#####
-    
-    channel_fft_x = []
-    channel_fft_y = []
-    channel_fft_z = []
-    
-    N = len(channel_1) # length of the signal
-    T = 1.0 / sample_rate
-    xf = np.linspace(0.0, 1.0/(2.0*T), int(N/2))
-    
-    yf1 = fftpack.fft(channel_1)
-    channel_fft_x = 2.0/N * np.abs(yf1[:int(N/2)])
-    
-    yf2 = fftpack.fft(channel_2)
-    channel_fft_y = 2.0/N * np.abs(yf2[:int(N/2)])
-    
-    yf3 = fftpack.fft(channel_3)
-    channel_fft_z = 2.0/N * np.abs(yf3[:int(N/2)])
-    
-    #####saving to CSV file#####
-    # Adding headers to the CSV file and writing the data
-    archive = "vibration_"+str(node_id)+ "_" + str(timeString)+".csv"
-    print("Saving to %s" %archive)
-    arch = open("/home/pi/Desktop/HiveMonitor2/parameter_capture/vibration_sensor/fft_log/"+archive, "w")
-    arch.write("Time,Amplitude_X,Amplitude_Y,Amplitude_Z,Frequency_X,Frequency_Y,Frequency_Z,FFT_Amplitude_X,FFT_Amplitude_Y,FFT_Amplitude_Z\n")
-    num_data = len(xf)
-    indice = 0
-
-    # Write data to the CSV file
-    while (indice < num_data):
-        arch.write(f"{indice/sample_rate},{channel_1[indice]},{channel_2[indice]},{channel_3[indice]},{xf[indice]},{xf[indice]},{xf[indice]},{channel_fft_x[indice]},{channel_fft_y[indice]},{channel_fft_z[indice]}\n")
-        indice = indice + 1
-
-    arch.close()
-    fname = archive
-    print("Saving complete")
+    if activity_int_pin is not None:
+        source = InterruptActivitySource(adxl345, trigger_threshold_g, activity_int_pin, fifo_rate)
+    else:
+        source = RmsActivitySource(adxl345, trigger_rms_g, rate_flag=BW_RATE_50HZ)
+    os.makedirs(trigger_log_dir, exist_ok=True)
+    processor = VibrationProcessor(trigger_samples, sample_rate)
+
+    def save_event(event):
+        capture = event.capture
+        stamp = datetime.datetime.fromtimestamp(event.time).strftime("%Y%m%d_%H%M%S_%f")
+        name = "vibration_event_"+str(node_id)+ "_" + stamp
+        print("Activity %.3f g, captured %s samples at %s Hz" %(event.level, capture.axes.shape[1], capture.sample_rate))
+        write_raw_archive(trigger_log_dir+name+raw_archive.EXTENSION, node_id, stamp, capture.sample_rate,
+                          adxl345.range_flag, SCALE_MULTIPLIER, capture.raw)
+        result = processor.process(capture.axes, capture.sample_rate)
+        write_spectral_log(trigger_log_dir+name+spectral_log.EXTENSION, node_id, stamp, capture.sample_rate,
+                           trigger_samples, result.signal, result.magnitude)
+        np.savez(trigger_log_dir+name+"_pretrigger.npz", samples=event.pretrigger,
+                 sample_rate=event.pretrigger_rate, level=event.level, overruns=capture.overruns)
+
+    print("START watching for activity")
+    triggered = TriggeredCapture(adxl345, source, trigger_samples, fifo_rate, trigger_holdoff)
+    try:
+        events = triggered.run(duration, on_event=save_event)
+    except KeyboardInterrupt:
+        events = None
     print("END")
-    return(fname)
-   
+    return events
+
 
 if __name__ == "__main__":
-    mainprog()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "stream":
+        streamprog(float(sys.argv[2]) if len(sys.argv) > 2 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == "trigger":
+        triggerprog(float(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        mainprog()
@@ -0,0 +1,101 @@
+# Reports what loading each capture script costs at startup.
+#
+# Every target is loaded in a fresh interpreter under `python -X importtime`
+# (its `if __name__ == "__main__"` block is not run) and the modules with the
+# largest cumulative import time are listed, next to the cost of starting a
+# bare interpreter. With --budget-ms the command exits non-zero when a
+# target's imports take longer than the budget.
+#
+#   python3 support_files/profile_startup.py
+#   python3 support_files/profile_startup.py parameter_capture/vibration_sensor/vibration.py --top 20 --budget-ms 300
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_TARGETS = [
+    "parameter_capture/capture_parameters.py",
+    "parameter_capture/vibration_sensor/vibration.py",
+    "multimedia_capture/capture.py",
+]
+
+# imported by the interpreter itself or by LOADER, not by the target
+IGNORED = ("site", "runpy", "pkgutil", "importlib.util", "importlib.machinery", "encodings", "zipimport", "codecs", "io", "abc", "_frozen_importlib_external")
+
+LOADER = ("import sys, runpy; path = sys.argv[1]; sys.path.insert(0, __import__('os').path.dirname(path)); "
+          "runpy.run_path(path, run_name='__profile__')")
+
+
+def interpreter_startup_ms(python):
+    start = time.perf_counter()
+    subprocess.run([python, "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+# returns (wall ms, [(module, self us, cumulative us, depth)], error output)
+def profile_target(python, path):
+    start = time.perf_counter()
+    result = subprocess.run([python, "-X", "importtime", "-c", LOADER, path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    imports = []
+    errors = []
+    # importtime lists the modules a module pulled in before the module
+    # itself, so collect lines until the top level (depth 0) entry they
+    # belong to and then keep or drop the whole group
+    group = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            errors.append(line)
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue    # the column header
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        group.append((name.strip(), int(fields[0]), int(fields[1]), depth))
+        if depth == 0:
+            if group[-1][0] not in IGNORED:
+                imports.extend(group)
+            group = []
+
+    error = "\n".join(errors) if result.returncode != 0 else ""
+    return wall_ms, imports, error
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import cost per module of the capture scripts")
+    parser.add_argument("targets", nargs="*", help="scripts to profile (default: the capture scripts)")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list per script")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if a script's imports exceed this")
+    parser.add_argument("--python", default=sys.executable, help="interpreter to profile with")
+    args = parser.parse_args()
+
+    targets = args.targets or [os.path.join(repo_dir, target) for target in DEFAULT_TARGETS]
+    over_budget = False
+
+    print("Bare interpreter startup: %.1f ms" % interpreter_startup_ms(args.python))
+    for target in targets:
+        wall_ms, imports, error = profile_target(args.python, os.path.abspath(target))
+        total_ms = sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000.0
+
+        print()
+        print("%s: %.1f ms wall, %.1f ms in imports" % (target, wall_ms, total_ms))
+        if error:
+            print("  (failed to load, numbers cover the imports up to the failure)")
+            print("  " + error.strip().splitlines()[-1])
+
+        print("  %10s %10s  module" % ("cumul ms", "self ms"))
+        for name, own, cumulative, depth in sorted(imports, key=lambda i: -i[2])[:args.top]:
+            print("  %10.1f %10.1f  %s" % (cumulative / 1000.0, own / 1000.0, name))
+
+        if args.budget_ms is not None and total_ms > args.budget_ms:
+            print("  OVER BUDGET: %.1f ms > %.1f ms" % (total_ms, args.budget_ms))
+            over_budget = True
+
+    sys.exit(1 if over_budget else 0)